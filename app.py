@@ -1,12 +1,24 @@
 import os
 import json
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import cProfile
+import time
+import uuid
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, send_file, stream_with_context, g
 from werkzeug.utils import secure_filename
 import traceback
 
 from scr.main import matcli
-from scr.extract_html import divisiontext
-from scr.extract_CRM_portfolio import json_file, count_sections_in_json, prompt_association, associate_titles_with_clients, prompt_final
+from scr.extract_html import complete_answer, parse_response, results_data
+from scr.extract_CRM_portfolio import associate_titles_with_clients, prompt_final, association_prompt_overhead
+from scr.extract_CRM_portfolio import advisor_slug, load_crm, json_file_incremental
+from scr.jobs import Job, JobQueue
+from scr.workspace import Workspace
+from scr.section_store import get_section_store
+from scr.export_prompts import iter_prompts_ndjson, prompts_zip_bytes
+from scr.llm_backend import CompletionBackend, associate_sections, save_results
+from scr.prematch import InstrumentIndex
+from scr.response_cache import ResponseCache
+from scr.metrics import metrics
 
 app = Flask(__name__)
 app.secret_key = 'newsletter_secret_key_2024'
@@ -16,134 +28,318 @@ UPLOAD_FOLDER = 'data'
 ALLOWED_EXTENSIONS = {'html', 'htm', 'xlsx', 'xls'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Taille maximale estimée (en tokens) d'un prompt de section ; None pour revenir aux sections de 100 instruments
+app.config['SECTION_TOKEN_BUDGET'] = 30000
+# Conseiller dont les clients sont associés aux titres
+app.config['CONSEILLER'] = 'ROLLAND JEAN-MARC'
+app.config['JOB_WORKERS'] = 2
+# Sections du précédent traitement de chaque conseiller, pour ne reconstruire que les clients modifiés
+app.config['SNAPSHOT_FOLDER'] = os.path.join(UPLOAD_FOLDER, 'snapshots')
+# Dossiers de travail (fichiers téléchargés, copie du CRM, résultats) supprimés après ce délai sans modification
+app.config['RUN_RETENTION'] = 7 * 24 * 3600
+# LLM local (API chat completions compatible OpenAI), par ex. `python -m scr.llm_stub` pour tester hors ligne
+app.config['LLM_ENDPOINT'] = os.environ.get('LLM_ENDPOINT')
+# Cache des réponses analysées, par empreinte du prompt de section (durée de vie en secondes, None = illimitée)
+app.config['RESPONSE_CACHE_TTL'] = 7 * 24 * 3600
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 10000
+# Résumé de la newsletter envoyé dans chaque prompt : extrait du texte suivant chaque titre (en caractères)
+app.config['DIGEST_CHARS_PER_TITLE'] = 600
+# Titres nommant une société détenue : associés sans LLM, par nom d'instrument ou d'émetteur
+app.config['PREMATCH_TITLES'] = True
+# Prompts compacts : chaque instrument listé une fois par section (par secteur), les clients en listes d'identifiants
+app.config['COMPACT_PROMPTS'] = False
+# Profilage cProfile de chaque requête, ou en mode debug seulement de celles portant l'en-tête PROFILE_HEADER
+# (par ex. 'X-Profile' ; None : en-tête ignoré). Seuls les PROFILE_MAX_FILES derniers profils sont gardés.
+app.config['PROFILE_REQUESTS'] = False
+app.config['PROFILE_HEADER'] = None
+app.config['PROFILE_FOLDER'] = os.path.join(UPLOAD_FOLDER, 'profiles')
+app.config['PROFILE_MAX_FILES'] = 50
 
 # Créer le dossier data s'il n'existe pas
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+jobs = JobQueue(max_workers=app.config['JOB_WORKERS'])
+response_cache = ResponseCache(ttl=app.config['RESPONSE_CACHE_TTL'],
+                               max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+
+UPLOAD_STAGES = [
+    ('parse_html', 'Conversion de la newsletter'),
+    ('load_crm', 'Lecture du fichier CRM'),
+    ('build_sections', 'Création des sections'),
+]
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Titres prédéfinis (comme dans le code original)
-TITRES = [
-    'BHP ( Market-Perform vs Outperform, TP 1900p vs 2000p)',
-    'Défense',
-    'Telco France',
-    'Eco Australie',
-    'Eco Chine',
-    'Centrica (=)',
-    'Equinor (+)',
-    'Kering (=)',
-    'Vodafone (=)',
-    'Land Securities',
-    'Aramis (=/+)',
-    'H&M (Underperform, TP: 110SEK)',
-    'Conviction Thinking',
-    'Equity Strategy',
-    'Covered Bonds Special',
-    'Credit Strategy Weekly Webcast – Can you spell insatiable?',
-    'Credit Strategy Weekly Webcast',
-    'EM Trade Idea Monitor - SG EM Trade Idea Monitor',
-    'Fixed Income Portfolio Strategy',
-    'Technical Analysis: 10y UST',
-    'Diageo',
-    'Emeis',
-    'Electric Revolution: Divergence — From Centralized Energy to Portable Power — Powering the Sustainable',
-    'Global Trucks: Pair trade - Long PACCAR',
-    'Porsche (04/06)',
-    'BMW (26/06)'
+LLM_STAGES = [
+    ('llm', 'Associations par le LLM'),
+    ('save', 'Enregistrement des réponses'),
 ]
 
+def profiling_requested():
+    header = app.config['PROFILE_HEADER']
+    return app.config['PROFILE_REQUESTS'] or bool(app.debug and header and request.headers.get(header))
+
+def prune_profiles(folder, keep):
+    """Deletes the oldest .prof files of folder beyond the keep most recent ones."""
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.prof')]
+    paths.sort(key=lambda path: os.stat(path).st_mtime_ns)
+    for path in paths[:max(len(paths) - keep, 0)]:
+        try:
+            os.remove(path)
+        except OSError:  # already removed by another worker
+            pass
+
+@app.before_request
+def start_profile():
+    if profiling_requested():
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is already active in this process
+            return
+        g.profiler = profiler
+
+@app.after_request
+def save_profile(response):
+    """Dumps the request profile (pstats format) to PROFILE_FOLDER; its name is returned in X-Profile-File."""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{request.endpoint or 'unknown'}_{uuid.uuid4().hex[:8]}.prof"
+    profiler.dump_stats(os.path.join(app.config['PROFILE_FOLDER'], name))
+    prune_profiles(app.config['PROFILE_FOLDER'], app.config['PROFILE_MAX_FILES'])
+    response.headers['X-Profile-File'] = name
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Pipeline spans (durations, counts, peak memory) in the Prometheus text format."""
+    cache_stats = response_cache.stats()
+    extra = {
+        'response_cache_hits_total': ('counter', 'Section prompts answered from the response cache.', cache_stats['hits']),
+        'response_cache_misses_total': ('counter', 'Section prompts not found in the response cache.', cache_stats['misses']),
+        'response_cache_entries': ('gauge', 'Entries in the response cache.', cache_stats['entries']),
+    }
+    return Response(metrics.render_prometheus(extra), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def wants_json():
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or \
+        request.accept_mimetypes.best == 'application/json'
+
+def upload_error(message):
+    if wants_json():
+        return jsonify({'success': False, 'error': message}), 400
+    flash(message, 'error')
+    return redirect(url_for('index'))
+
+def current_workspace():
+    """Workspace of the run of this browser session, or None if there is none yet."""
+    run_id = session.get('run_id')
+    return Workspace(run_id) if Workspace.exists(run_id) else None
+
+def no_workspace_error():
+    return jsonify({'success': False, 'error': 'Aucun traitement en cours : veuillez d\'abord télécharger vos fichiers.'})
+
+def run_titles(workspace):
+    """Titles of the run's newsletter, extracted once at upload (see matcli)."""
+    if workspace is None or not os.path.exists(workspace.titles):
+        return []
+    with open(workspace.titles, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def process_upload(job, workspace, html_path, excel_path):
+    """Pipeline run in the background for an upload (see /upload)."""
+    with job.stage('parse_html'):
+        titres = matcli(html_path, workspace.newsletter_md, workspace.news_resume,
+                        app.config['DIGEST_CHARS_PER_TITLE'], workspace.titles).events
+        if not titres:
+            raise ValueError("Aucun titre trouvé dans le sommaire de la newsletter")
+    with job.stage('load_crm'):
+        load_crm(excel_path)
+    with job.stage('build_sections'):
+        conseiller = app.config['CONSEILLER']
+        token_budget = app.config['SECTION_TOKEN_BUDGET']
+        prompt_overhead = association_prompt_overhead(titres, workspace.news_resume) if token_budget else 0
+        snapshot_path = os.path.join(app.config['SNAPSHOT_FOLDER'], advisor_slug(conseiller) + '.json')
+        report = json_file_incremental(conseiller, excel_path, workspace.clients_sections, snapshot_path,
+                                       token_budget, prompt_overhead)
+    return {'nb_sections': report['kept_sections'] + report['rebuilt_sections'],
+            'run_id': workspace.run_id, 'sections': report}
+
 @app.route('/upload', methods=['POST'])
 def upload_files():
     try:
         # Vérifier les fichiers uploadés
         if 'html_file' not in request.files or 'excel_file' not in request.files:
-            flash('Veuillez sélectionner à la fois un fichier HTML et un fichier Excel', 'error')
-            return redirect(url_for('index'))
+            return upload_error('Veuillez sélectionner à la fois un fichier HTML et un fichier Excel')
         
         html_file = request.files['html_file']
         excel_file = request.files['excel_file']
         
         if html_file.filename == '' or excel_file.filename == '':
-            flash('Veuillez sélectionner les deux fichiers', 'error')
-            return redirect(url_for('index'))
+            return upload_error('Veuillez sélectionner les deux fichiers')
         
         if html_file and allowed_file(html_file.filename) and excel_file and allowed_file(excel_file.filename):
             # Sauvegarder les fichiers
             html_filename = secure_filename(html_file.filename)
-            excel_filename = secure_filename(excel_file.filename)
             
-            html_path = os.path.join(app.config['UPLOAD_FOLDER'], html_filename)
-            excel_path = os.path.join(app.config['UPLOAD_FOLDER'], excel_filename)
+            # Chaque téléchargement a son propre dossier de travail ; les plus anciens sont supprimés
+            Workspace.prune(app.config['RUN_RETENTION'])
+            workspace = Workspace()
+            session['run_id'] = workspace.run_id
+            
+            html_path = workspace.file(html_filename)
+            excel_path = workspace.crm
             
             html_file.save(html_path)
             excel_file.save(excel_path)
             
-            # Traitement des fichiers (comme dans interface.py)
-            matrix_client_events = matcli(html_path)
-            json_file('ROLLAND JEAN-MARC', excel_path)
-            
-            # Compter le nombre de sections
-            nbr_section = count_sections_in_json('data/clients_sections.json')
+            if wants_json():
+                # Le traitement tourne en tâche de fond ; le client suit /api/jobs/<job_id>
+                job = jobs.submit(UPLOAD_STAGES, process_upload, workspace, html_path, excel_path,
+                                  job_id=workspace.run_id, status_path=workspace.job_status)
+                return jsonify({'success': True, 'job_id': job.id,
+                                'status_url': url_for('job_status_api', job_id=job.id)}), 202
             
+            # Formulaire classique : aucune page ne suit le traitement, on attend donc sa fin
+            job = jobs.run(UPLOAD_STAGES, process_upload, workspace, html_path, excel_path,
+                           job_id=workspace.run_id, status_path=workspace.job_status)
+            if job.status == 'error':
+                return upload_error(f'Erreur lors du traitement: {job.error}')
+            nbr_section = job.result['nb_sections']
             flash(f'Fichiers traités avec succès! {nbr_section} sections créées.', 'success')
             return redirect(url_for('sections', nb_sections=nbr_section))
         
         else:
-            flash('Types de fichiers non autorisés', 'error')
-            return redirect(url_for('index'))
+            return upload_error('Types de fichiers non autorisés')
             
     except Exception as e:
-        flash(f'Erreur lors du traitement: {str(e)}', 'error')
         traceback.print_exc()
-        return redirect(url_for('index'))
+        return upload_error(f'Erreur lors du traitement: {str(e)}')
+
+def job_status(job_id):
+    """Status of a job, from memory or, when another server process runs it, from its workspace."""
+    job = jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    run_id = Workspace.run_of_job(job_id)
+    if Workspace.exists(run_id):
+        return Job.read_status(Workspace(run_id).job_file(job_id))
+    return None
+
+@app.route('/api/jobs/<job_id>')
+def job_status_api(job_id):
+    status = job_status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Traitement introuvable'}), 404
+    return jsonify({'success': True, **status})
 
 @app.route('/sections/<int:nb_sections>')
 def sections(nb_sections):
-    return render_template('sections.html', nb_sections=nb_sections, titres=TITRES)
+    return render_template('sections.html', nb_sections=nb_sections, titres=run_titles(current_workspace()))
 
 @app.route('/api/generate_prompt/<int:section_id>')
 def generate_prompt_api(section_id):
+    workspace = current_workspace()
+    if workspace is None:
+        return no_workspace_error()
+    try:
+        store = get_section_store(workspace.clients_sections, workspace.news_resume,
+                                  compact=app.config['COMPACT_PROMPTS'])
+        prompt_text = store.prompt(run_titles(workspace), section_id)
+        # Réponse déjà connue pour ce prompt exact (même section, même newsletter)
+        cached = response_cache.get(prompt_text)
+        cached_response = {'list': cached[0], 'summary': cached[1]} if cached else None
+        return jsonify({'success': True, 'prompt': prompt_text, 'cached_response': cached_response})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/generate_prompts')
+def generate_prompts_api():
+    """Tous les prompts de sections en une réponse : NDJSON en flux (défaut) ou archive zip (?format=zip)."""
+    workspace = current_workspace()
+    if workspace is None:
+        return no_workspace_error()
     try:
-        prompt_text = prompt_association(
-            TITRES, 
-            'data/news_résume.md', 
-            section_id, 
-            json_path="data/clients_sections.json"
-        )
-        return jsonify({'success': True, 'prompt': prompt_text})
+        store = get_section_store(workspace.clients_sections, workspace.news_resume,
+                                  compact=app.config['COMPACT_PROMPTS'])
+        titres = run_titles(workspace)
+        if request.args.get('format') == 'zip':
+            return send_file(prompts_zip_bytes(store, titres), mimetype='application/zip',
+                             as_attachment=True, download_name='prompts_sections.zip')
+        return Response(stream_with_context(iter_prompts_ndjson(store, titres)),
+                        mimetype='application/x-ndjson')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def instrument_index(workspace, sections):
+    """Direct-match index of a run: from its CRM copy (names and ISINs), else from its sections (names only)."""
+    if not os.path.exists(workspace.crm):
+        return InstrumentIndex.from_sections(sections)
+    df = load_crm(workspace.crm)
+    return InstrumentIndex.from_crm(df[df['CONSEILLER'] == app.config['CONSEILLER']])
+
+def process_auto_associate(job, workspace):
+    """Sends every section prompt to the configured LLM and saves the parsed answers."""
+    with job.stage('llm'):
+        backend = CompletionBackend.from_env(endpoint=app.config['LLM_ENDPOINT'])
+        store = get_section_store(workspace.clients_sections, workspace.news_resume,
+                                  compact=app.config['COMPACT_PROMPTS'])
+        index = instrument_index(workspace, store.sections) if app.config['PREMATCH_TITLES'] else None
+        output_data = associate_sections(store, run_titles(workspace), backend, response_cache, index)
+    with job.stage('save'):
+        save_results(output_data, workspace.results_processed)
+    # Sections whose LLM call failed or whose answer is unreadable are not cached; running the job again only resends them
+    return {'nb_sections': len(output_data['all_lists']), 'run_id': workspace.run_id,
+            'failed_sections': output_data['failed_sections'], 'cache': response_cache.stats()}
+
+@app.route('/api/auto_associate', methods=['POST'])
+def auto_associate_api():
+    """Remplace le copier/coller des prompts : toutes les sections partent au LLM en tâche de fond."""
+    workspace = current_workspace()
+    if workspace is None:
+        return no_workspace_error()
+    if not app.config['LLM_ENDPOINT']:
+        return jsonify({'success': False, 'error': 'Aucun LLM configuré (variable LLM_ENDPOINT).'})
+    job_id = workspace.new_job_id()
+    job = jobs.submit(LLM_STAGES, process_auto_associate, workspace,
+                      job_id=job_id, status_path=workspace.job_file(job_id))
+    return jsonify({'success': True, 'job_id': job.id,
+                    'status_url': url_for('job_status_api', job_id=job.id)}), 202
+
+def remember_responses(workspace, responses, parsed_responses):
+    """Puts the pasted answers that parsed completely in the response cache, keyed by their section prompt."""
+    if not (os.path.exists(workspace.clients_sections) and os.path.exists(workspace.news_resume)):
+        return
+    store = get_section_store(workspace.clients_sections, workspace.news_resume,
+                              compact=app.config['COMPACT_PROMPTS'])
+    titres = run_titles(workspace)
+    for section_idx, (response_text, parsed) in enumerate(zip(responses, parsed_responses)):
+        if section_idx < len(store) and complete_answer(parsed, len(titres)):
+            response_cache.put(store.prompt(titres, section_idx), parsed)
+
 @app.route('/api/save_responses', methods=['POST'])
 def save_responses():
+    workspace = current_workspace()
+    if workspace is None:
+        return no_workspace_error()
     try:
         responses = request.json.get('responses', [])
         
         # Traiter toutes les zones de texte (comme process_all_text_zones)
-        all_lists = []
-        all_summaries = []
-        
-        for response_text in responses:
-            if response_text.strip():
-                the_list, the_summary = divisiontext(response_text)
-                all_lists.append(the_list)
-                all_summaries.append(the_summary)
-            else:
-                all_lists.append([])
-                all_summaries.append("")
+        parsed_responses = [parse_response(response_text) for response_text in responses]
+        output_data = results_data(parsed_responses)
+        remember_responses(workspace, responses, parsed_responses)
         
         # Sauvegarder dans le fichier JSON
-        output_data = {
-            "all_lists": all_lists,
-            "all_summaries": all_summaries
-        }
-        
-        with open("data/results_processed.json", "w", encoding="utf-8") as f:
+        with open(workspace.results_processed, "w", encoding="utf-8") as f:
             json.dump(output_data, f, ensure_ascii=False, indent=2)
         
         return jsonify({'success': True, 'message': 'Réponses sauvegardées avec succès!'})
@@ -153,15 +349,18 @@ def save_responses():
 
 @app.route('/api/generate_final_prompt')
 def generate_final_prompt_api():
+    workspace = current_workspace()
+    if workspace is None:
+        return no_workspace_error()
     try:
         # Vérifier l'existence des fichiers requis
-        if not os.path.exists("data/results_processed.json"):
+        if not os.path.exists(workspace.results_processed):
             return jsonify({'success': False, 'error': 'Le fichier results_processed.json n\'existe pas encore.'})
         
-        if not os.path.exists("data/newsletter_md.md"):
+        if not os.path.exists(workspace.newsletter_md):
             return jsonify({'success': False, 'error': 'Le fichier newsletter_md.md n\'existe pas.'})
         
-        prompt = prompt_final(TITRES, "data/results_processed.json", "data/newsletter_md.md")
+        prompt = prompt_final(run_titles(workspace), workspace.results_processed, workspace.newsletter_md)
         return jsonify({'success': True, 'prompt': prompt})
         
     except Exception as e:
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from scr.extract_CRM_portfolio import (advisor_slug, associate_titles_with_clients, build_association_prompt,
+                                       clients_from_frame, grouped_clients_json, incremental_sections, load_crm,
+                                       portfolio_fingerprints, read_json, render_section, sections_snapshot,
+                                       write_sections_json)
+from scr.extract_html import ClientInjector, Newsletter, cached_events, html_to_markdown_with_table
+from scr.llm_backend import CompletionBackend, associate_sections, save_results
+from scr.prematch import InstrumentIndex
+from scr.response_cache import ResponseCache
+from scr.section_store import SectionStore
+
+
+def advisor_filename(conseiller):
+    return f"clients_sections_{advisor_slug(conseiller)}.json"
+
+
+def _build_advisor_sections(conseiller, df_conseiller, output_path, instrument_limit, snapshot_path=None):
+    start = time.perf_counter()
+    # Same clients as list_action_clients: instrument_limit only sizes the sections
+    clients = clients_from_frame(df_conseiller)
+    report = {}
+    if snapshot_path:
+        previous = read_json(snapshot_path) if os.path.exists(snapshot_path) else None
+        fingerprints = portfolio_fingerprints(df_conseiller)
+        sections, report = incremental_sections(clients, fingerprints, previous, instrument_limit=instrument_limit)
+        write_sections_json(sections_snapshot(fingerprints, sections, instrument_limit=instrument_limit), snapshot_path)
+    else:
+        sections = grouped_clients_json(clients, instrument_limit=instrument_limit)
+    write_sections_json(sections, output_path)
+    return {
+        "conseiller": conseiller,
+        "output_path": output_path,
+        "clients": len(clients),
+        "sections": len(sections),
+        "seconds": time.perf_counter() - start,
+        **report,
+    }
+
+
+def build_all_sections(fichier_xlsx, output_dir="data/advisors", workers=None, instrument_limit=100, incremental=False,
+                       advisors=None):
+    """
+    Builds the clients_sections JSON of every advisor of the CRM export in one run.
+
+    The workbook is loaded once (see load_crm), split by CONSEILLER, and each advisor
+    is sectioned in its own worker process and written to
+    output_dir/clients_sections_<advisor>.json.
+
+    Args:
+        fichier_xlsx (str): Path to the CRM Excel export.
+        output_dir (str): Directory receiving one JSON file per advisor.
+        workers (int): Number of worker processes (defaults to the CPU count).
+        instrument_limit (int): Maximum number of instruments per section (a client holding
+            more gets a section of its own).
+        incremental (bool): Only rebuild the sections whose clients changed since the
+            previous run (snapshots kept in output_dir/snapshots, see incremental_sections).
+        advisors (list): Only these advisors (all of them when None).
+
+    Returns:
+        list: One report dict per advisor (conseiller, output_path, clients, sections, seconds),
+        in the order advisors appear in the workbook.
+    """
+    df = load_crm(fichier_xlsx)
+    df = df[df['CONSEILLER'].notna()]
+    if advisors is not None:
+        df = df[df['CONSEILLER'].isin(advisors)]
+    os.makedirs(output_dir, exist_ok=True)
+    snapshot_dir = os.path.join(output_dir, "snapshots")
+    if incremental:
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+    order = {}
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for conseiller, df_conseiller in df.groupby('CONSEILLER', sort=False):
+            order[conseiller] = len(order)
+            output_path = os.path.join(output_dir, advisor_filename(conseiller))
+            snapshot_path = os.path.join(snapshot_dir, advisor_filename(conseiller)) if incremental else None
+            futures.append(pool.submit(_build_advisor_sections, conseiller, df_conseiller,
+                                       output_path, instrument_limit, snapshot_path))
+        for future in as_completed(futures):
+            report = future.result()
+            reused = f", {report['kept_sections']} reprises" if "kept_sections" in report else ""
+            print(f"{report['conseiller']}: {report['sections']} sections{reused}, "
+                  f"{report['clients']} clients in {report['seconds']:.2f}s")
+            reports.append(report)
+
+    reports.sort(key=lambda report: order[report["conseiller"]])
+    return reports
+
+
+class PairSections:
+    """
+    SectionStore stand-in for one (newsletter, advisor) pair of personalize_all: the
+    advisor's sections, rendered once for all newsletters, and the newsletter digest.
+    """
+
+    def __init__(self, sections, rendered, newsletter):
+        self.sections = sections
+        self.rendered = rendered
+        self.newsletter = newsletter
+
+    def __len__(self):
+        return len(self.sections)
+
+    def prompt(self, titres, section_idx):
+        """Same prompt as SectionStore.prompt."""
+        return build_association_prompt(SectionStore._section_text(self.rendered, section_idx), self.newsletter, titres)
+
+
+def _prepare_advisor(report, df, compact=False, prematch=True):
+    sections = read_json(report["output_path"])
+    df_conseiller = df[df["CONSEILLER"] == report["conseiller"]]
+    return {
+        "conseiller": report["conseiller"],
+        "slug": advisor_slug(report["conseiller"]),
+        "sections": sections,
+        "rendered": [render_section(section, compact=compact) for section in sections],
+        "index": InstrumentIndex.from_crm(df_conseiller) if prematch else None,
+    }
+
+
+def _prepare_newsletter(html_path, output_dir, chars_per_title=600):
+    """Parses a newsletter once and writes its titles, Markdown and digest to output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(html_path, "r", encoding="utf-8") as f:
+        html = f.read()
+    newsletter = Newsletter(html)
+    titres = cached_events(html, newsletter=newsletter)
+    if not titres:
+        raise ValueError(f"Aucun titre trouvé dans le sommaire de {html_path}")
+    with open(os.path.join(output_dir, "titles.json"), "w", encoding="utf-8") as f:
+        json.dump(titres, f, ensure_ascii=False, indent=2)
+    html_to_markdown_with_table(html_path, os.path.join(output_dir, "newsletter_md.md"))
+    digest = newsletter.digest(titres, chars_per_title)
+    with open(os.path.join(output_dir, "news_résume.md"), "w", encoding="utf-8") as f:
+        f.write(digest)
+    return {
+        "name": os.path.basename(output_dir),
+        "dir": output_dir,
+        "titres": titres,
+        "digest": digest,
+        "injector": ClientInjector(newsletter),
+    }
+
+
+def _personalize_pair(newsletter, advisor, backend, cache):
+    start = time.perf_counter()
+    store = PairSections(advisor["sections"], advisor["rendered"], newsletter["digest"])
+    output_data = associate_sections(store, newsletter["titres"], backend, cache, advisor["index"])
+    results_path = os.path.join(newsletter["dir"], f"results_{advisor['slug']}.json")
+    save_results(output_data, results_path)
+    matrix = associate_titles_with_clients(results_path, newsletter["titres"]).to_list()
+    output_path = os.path.join(newsletter["dir"], f"newsletter_{advisor['slug']}.html")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(newsletter["injector"].inject(matrix))
+    return {
+        "newsletter": newsletter["name"],
+        "conseiller": advisor["conseiller"],
+        "output_path": output_path,
+        "sections": len(store),
+        "titles_with_clients": sum(1 for _, clients in matrix if clients),
+        "failed_sections": output_data["failed_sections"],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def personalize_all(newsletter_paths, fichier_xlsx, output_dir="data/batch", advisors=None, workers=4, backend=None,
+                    cache=None, prematch=True, compact=False, chars_per_title=600, instrument_limit=100):
+    """
+    Personalizes every newsletter for every advisor (N x M pairs) in one run.
+
+    Everything a pair shares is prepared once: the CRM is loaded and sectioned per
+    advisor (build_all_sections), each advisor's sections are rendered and its CRM rows
+    indexed for the direct matches (names and ISINs) once, and each newsletter is parsed once for its titles, Markdown,
+    digest and client injection (ClientInjector). The pairs then run on a thread pool:
+    association of every section (associate_sections, through the LLM backend and the
+    response cache; direct matches only when backend is None), then the newsletter with
+    the clients under each title (add_clients_after_titles).
+
+    Outputs go to output_dir/<newsletter>/: titles.json, newsletter_md.md, news_résume.md,
+    and per advisor results_<advisor>.json and newsletter_<advisor>.html. The sections are
+    in output_dir/sections and the summary in output_dir/batch_summary.json.
+
+    Args:
+        newsletter_paths (list): HTML newsletters.
+        fichier_xlsx (str): Path to the CRM Excel export.
+        advisors (list): Advisors to personalize for (all of the CRM when None).
+        workers (int): Pairs processed at the same time (and processes used for sectioning).
+        backend (CompletionBackend): LLM answering the section prompts, or None.
+        cache (ResponseCache): Cache of the parsed answers, or None.
+        prematch (bool): Match titles naming a held company without the LLM.
+        compact (bool): Compact client tables in the prompts (render_section_compact).
+
+    Returns:
+        dict: {"newsletters", "advisors", "pairs", "seconds", "pairs_per_minute", "reports"},
+        one report per pair (newsletter, conseiller, output_path, sections,
+        titles_with_clients, failed_sections, seconds), newsletters in the given
+        order, then advisors in CRM order.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    section_reports = build_all_sections(fichier_xlsx, os.path.join(output_dir, "sections"), workers,
+                                         instrument_limit, advisors=advisors)
+    df = load_crm(fichier_xlsx)
+    advisor_data = [_prepare_advisor(report, df, compact, prematch) for report in section_reports]
+
+    newsletters = []
+    names = set()
+    for html_path in newsletter_paths:
+        name = os.path.splitext(os.path.basename(html_path))[0]
+        if name in names:
+            name = f"{name}_{len(newsletters) + 1}"
+        names.add(name)
+        newsletters.append(_prepare_newsletter(html_path, os.path.join(output_dir, name), chars_per_title))
+
+    order = {}
+    reports = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for newsletter in newsletters:
+            for advisor in advisor_data:
+                order[(newsletter["name"], advisor["conseiller"])] = len(order)
+                futures.append(pool.submit(_personalize_pair, newsletter, advisor, backend, cache))
+        for future in as_completed(futures):
+            report = future.result()
+            failed = f", {len(report['failed_sections'])} en échec" if report["failed_sections"] else ""
+            print(f"{report['newsletter']} / {report['conseiller']}: {report['titles_with_clients']} titres avec clients, "
+                  f"{report['sections']} sections{failed} en {report['seconds']:.2f}s")
+            reports.append(report)
+
+    reports.sort(key=lambda report: order[(report["newsletter"], report["conseiller"])])
+    seconds = time.perf_counter() - start
+    summary = {
+        "newsletters": len(newsletters),
+        "advisors": len(advisor_data),
+        "pairs": len(reports),
+        "seconds": seconds,
+        "pairs_per_minute": len(reports) * 60 / seconds if seconds else 0.0,
+        "reports": reports,
+    }
+    with open(os.path.join(output_dir, "batch_summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère les sections clients de tous les conseillers, "
+                                                 "ou avec --newsletters les newsletters personnalisées de chacun.")
+    parser.add_argument("fichier_xlsx", help="Export CRM (.xlsx)")
+    parser.add_argument("--output-dir", default=None, help="data/advisors, ou data/batch avec --newsletters")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--instrument-limit", type=int, default=100)
+    parser.add_argument("--incremental", action="store_true",
+                        help="Ne reconstruire que les sections des clients modifiés depuis le dernier passage")
+    parser.add_argument("--advisors", nargs="+", default=None, help="Conseillers à traiter (tous par défaut)")
+    parser.add_argument("--newsletters", nargs="+", default=None,
+                        help="Newsletters HTML à personnaliser pour chaque conseiller")
+    parser.add_argument("--endpoint", default=os.environ.get("LLM_ENDPOINT"),
+                        help="API chat completions ; sans elle, seules les correspondances directes sont faites")
+    parser.add_argument("--model", default=os.environ.get("LLM_MODEL", "local"))
+    parser.add_argument("--concurrency", type=int, default=4, help="Requêtes LLM simultanées par paire")
+    parser.add_argument("--no-cache", action="store_true", help="Ne pas utiliser le cache des réponses")
+    parser.add_argument("--no-prematch", action="store_true",
+                        help="Envoyer tous les titres au LLM, sans correspondance directe par nom d'émetteur")
+    parser.add_argument("--compact", action="store_true", help="Tables clients compactes (identifiants d'instruments)")
+    parser.add_argument("--chars-per-title", type=int, default=600, help="Taille du résumé de la newsletter par titre")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if not args.newsletters:
+        reports = build_all_sections(args.fichier_xlsx, args.output_dir or "data/advisors", args.workers,
+                                     args.instrument_limit, args.incremental, args.advisors)
+        print(f"{len(reports)} conseillers traités en {time.perf_counter() - start:.2f}s")
+        return
+
+    backend = None
+    if args.endpoint:
+        backend = CompletionBackend(args.endpoint, model=args.model, max_concurrency=args.concurrency)
+    else:
+        print("Pas de LLM_ENDPOINT : seules les correspondances directes sont faites")
+    cache = None if args.no_cache else ResponseCache()
+    summary = personalize_all(args.newsletters, args.fichier_xlsx, args.output_dir or "data/batch", args.advisors,
+                              args.workers or 4, backend, cache, not args.no_prematch, args.compact,
+                              args.chars_per_title, args.instrument_limit)
+    print(f"{summary['pairs']} paires ({summary['newsletters']} newsletters x {summary['advisors']} conseillers) "
+          f"en {summary['seconds']:.2f}s : {summary['pairs_per_minute']:.1f} paires/minute")
+    if cache is not None:
+        print(f"Cache des réponses : {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
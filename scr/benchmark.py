@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import pandas as pd
+
+from scr import extract_CRM_portfolio
+from scr.client_matrix import ClientMatrix
+from scr.extract_CRM_portfolio import grouped_clients_json, list_action_clients, load_crm, prompt_association, write_sections_json
+from scr.extract_html import add_clients_after_titles, get_all_events, html_to_markdown_with_table
+from scr.main import add_clients_from_report
+
+ISSUERS = ["Kering", "Vodafone", "Diageo", "BMW", "Porsche", "Centrica", "Equinor", "BHP", "Emeis", "Aramis",
+           "Land Securities", "Hennes Mauritz", "TotalEnergies", "Orange", "Bouygues", "Air Liquide", "Sanofi",
+           "Schneider Electric", "Airbus", "Danone", "Engie", "Capgemini", "Safran", "Michelin", "Renault"]
+THEMES = ["Défense", "Telco France", "Eco Chine", "Eco Australie", "Equity Strategy", "Covered Bonds Special",
+          "Credit Strategy Weekly", "Fixed Income Portfolio Strategy", "Technical Analysis: 10y UST"]
+INSTRUMENT_TYPES = ["Actions", "Obligations", "Fonds", "Produits structurés"]
+COUNTRIES = ["France", "Royaume-Uni", "Allemagne", "Suisse", "Etats-Unis", "Norvège"]
+WORDS = ("résultats consensus dividende guidance marge croissance trimestre valorisation dette cession "
+         "acquisition analyste objectif cours révision hausse baisse publication perspectives").split()
+
+
+def synthetic_crm(path, advisors=3, portfolios=200, holdings=20, seed=0):
+    """
+    Writes a CRM export like the real one (duplicated INSTRUMENT header included):
+    portfolios spread over advisors, each holding about holdings instruments.
+    Returns the advisor names.
+    """
+    rng = random.Random(seed)
+    names = [f"CONSEILLER {chr(65 + i % 26)}{i // 26 or ''}" for i in range(advisors)]
+    instruments = [(f"FR{n:010d}", f"{issuer.upper()} {kind.upper()} {n}", issuer, kind)
+                   for n, (issuer, kind) in enumerate((issuer, kind) for issuer in ISSUERS for kind in INSTRUMENT_TYPES)]
+    rows = []
+    for p in range(portfolios):
+        conseiller = names[p % advisors]
+        portfolio = f"MC{p + 1:07d}"
+        for _ in range(max(1, int(rng.gauss(holdings, holdings / 3)))):
+            isin, instrument, issuer, kind = rng.choice(instruments)
+            rows.append([conseiller, portfolio, isin, instrument, kind, issuer, rng.choice(COUNTRIES), rng.random()])
+    df = pd.DataFrame(rows, columns=['CONSEILLER', 'Portfolio', 'CODE ISIN', 'INSTRUMENT', 'INSTRUMENT',
+                                     'EMMETEUR', 'EMMETEUR/PAYS DE RESIDENCE', 'AUTRE'])
+    df.to_excel(path, index=False)
+    return names
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_newsletter(path, titles=30, tables=3, paragraphs=4, seed=0):
+    """
+    Writes an HTML newsletter shaped like the real ones: a table of contents (two-cell
+    rows, titles separated by ' / '), data tables, and per title a heading paragraph
+    followed by bullet-point paragraphs and a blank line. Returns the titles.
+    """
+    rng = random.Random(seed)
+    pool = [f"{issuer} (=)" for issuer in ISSUERS] + THEMES
+    titres = [pool[i] if i < len(pool) else f"{rng.choice(ISSUERS)} Conference {i} (0{i % 9 + 1}/06)"
+              for i in range(titles)]
+
+    html = ["<html><body>", "<p class=MsoNormal><b>SOMMAIRE</b></p>", "<table>"]
+    for start in range(0, len(titres), 3):
+        group = " / ".join(titres[start:start + 3])
+        html.append(f"<tr><td><p><b>· Rubrique {start // 3 + 1}</b></p></td><td><p><b>{group}</b></p></td></tr>")
+    html.append("</table>")
+    for t in range(tables):
+        html.append("<table><tr><th>Valeur</th><th>Cours</th><th>Variation</th></tr>")
+        for issuer in rng.sample(ISSUERS, 8):
+            html.append(f"<tr><td>{issuer}</td><td>{rng.uniform(5, 500):.2f}</td><td>{rng.uniform(-5, 5):+.1f}%</td></tr>")
+        html.append("</table>")
+    for title in titres:
+        html.append(f"<p class=MsoNormal><b>{title.upper()}</b> : {_sentence(rng)}</p>")
+        for _ in range(paragraphs):
+            html.append(f"<p class=MsoNormal>· {_sentence(rng, 20)}</p>")
+        html.append("<p class=MsoNormal>&nbsp;</p>")
+    html.append("<p class=MsoNormal>MARKETING ANALYSTE</p><p>Contacts</p></body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(html))
+    return titres
+
+
+def synthetic_report(path, clients, titres, events_per_client=3, seed=0):
+    """Writes an LLM report ('=== MCxxxxxxx ===' blocks) linking each client to a few titles."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for client in clients:
+            f.write(f"=== {client} ===\n")
+            for title in rng.sample(titres, min(events_per_client, len(titres))):
+                f.write(f"{title} - {_sentence(rng, 6)}\n")
+            f.write(f"{_sentence(rng, 25)}\n\n")
+
+
+def time_stage(func, repeat=3):
+    """Runs func repeat times; returns its timings (seconds) and its last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+    }, result
+
+
+def run_benchmark(workdir, advisors=3, portfolios=200, holdings=20, titles=30, tables=3, paragraphs=4,
+                  repeat=3, seed=0):
+    """
+    Generates the synthetic inputs in workdir and times every stage of the pipeline on them.
+
+    Returns:
+        dict: {"params", "environment", "stages": {stage: {repeat, min, median, mean}}}
+    """
+    os.makedirs(workdir, exist_ok=True)
+    xlsx = os.path.join(workdir, "crm.xlsx")
+    html = os.path.join(workdir, "newsletter.html")
+    md = os.path.join(workdir, "newsletter_md.md")
+    sections_json = os.path.join(workdir, "clients_sections.json")
+    report = os.path.join(workdir, "report.txt")
+    annotated = os.path.join(workdir, "newsletter_clients.html")
+
+    conseiller = synthetic_crm(xlsx, advisors, portfolios, holdings, seed)[0]
+    titres = synthetic_newsletter(html, titles, tables, paragraphs, seed)
+
+    stages = {}
+    stages["html_to_markdown_with_table"], _ = time_stage(lambda: html_to_markdown_with_table(html, md), repeat)
+    stages["get_all_events"], _ = time_stage(lambda: get_all_events(html), repeat)
+
+    def load_crm_cold():
+        extract_CRM_portfolio._crm_frames.clear()
+        return load_crm(xlsx, cache_dir=None)
+    stages["load_crm (Excel)"], _ = time_stage(load_crm_cold, 1)
+    stages["list_action_clients"], clients = time_stage(lambda: list_action_clients(conseiller, xlsx), repeat)
+    stages["grouped_clients_json"], sections = time_stage(lambda: grouped_clients_json(clients), repeat)
+    write_sections_json(sections, sections_json)
+
+    def all_prompts():
+        return [prompt_association(titres, md, idx, sections_json) for idx in range(len(sections))]
+    stages["prompt_association (all sections)"], _ = time_stage(all_prompts, repeat)
+
+    synthetic_report(report, clients['Portfolio'].tolist(), titres, seed=seed)
+    stages["add_clients_from_report"], (matrix, _) = time_stage(
+        lambda: add_clients_from_report(ClientMatrix(titres), report), repeat)
+    stages["add_clients_after_titles"], _ = time_stage(
+        lambda: add_clients_after_titles(html, matrix.to_list(), annotated), repeat)
+
+    return {
+        "params": {"advisors": advisors, "portfolios": portfolios, "holdings": holdings, "titles": titles,
+                   "tables": tables, "paragraphs": paragraphs, "repeat": repeat, "seed": seed},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "pandas": pd.__version__, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "sizes": {"clients": len(clients), "sections": len(sections), "html_bytes": os.path.getsize(html)},
+        "stages": stages,
+    }
+
+
+def compare_results(baseline, current):
+    """Per-stage median timings of two run_benchmark results and the speedup of current."""
+    comparison = {}
+    for stage, stats in current["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None:
+            continue
+        comparison[stage] = {
+            "before": before["median"],
+            "after": stats["median"],
+            "speedup": before["median"] / stats["median"] if stats["median"] else float("inf"),
+        }
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure chaque étape du traitement sur des données synthétiques.")
+    parser.add_argument("--workdir", default="data/benchmark", help="Dossier des fichiers générés")
+    parser.add_argument("--advisors", type=int, default=3)
+    parser.add_argument("--portfolios", type=int, default=200)
+    parser.add_argument("--holdings", type=int, default=20, help="Instruments par portefeuille (moyenne)")
+    parser.add_argument("--titles", type=int, default=30)
+    parser.add_argument("--tables", type=int, default=3)
+    parser.add_argument("--paragraphs", type=int, default=4, help="Paragraphes par titre")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Fichier JSON des résultats")
+    parser.add_argument("--compare", help="Résultats JSON d'un passage précédent, à comparer")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.workdir, args.advisors, args.portfolios, args.holdings, args.titles,
+                            args.tables, args.paragraphs, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for stage, stats in compare_results(baseline, results).items():
+            print(f"{stage:<36} {stats['before']:>9.4f}s -> {stats['after']:>9.4f}s  x{stats['speedup']:.2f}")
+    else:
+        for stage, stats in results["stages"].items():
+            print(f"{stage:<36} médiane {stats['median']:>9.4f}s  min {stats['min']:>9.4f}s")
+    if not args.output:
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
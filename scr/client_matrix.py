@@ -0,0 +1,137 @@
+import sys
+
+
+def _intern(client):
+    return sys.intern(client) if type(client) is str else client
+
+
+class ClientSet(dict):
+    """
+    Insertion-ordered set of client numbers (keys of a dict).
+
+    It keeps the list idioms the pipeline uses on matrix rows (`row[1].append(c)`,
+    `c in row[1]`, iteration, `', '.join(row[1])`) but with O(1) membership and no duplicates.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, clients=()):
+        super().__init__()
+        self.update_clients(clients)
+
+    def append(self, client):
+        self[_intern(client)] = None
+
+    add = append
+
+    def update_clients(self, clients):
+        for client in clients:
+            self[_intern(client)] = None
+
+    def __repr__(self):
+        return f"ClientSet({list(self)!r})"
+
+
+class ClientMatrix:
+    """
+    Event -> clients matrix.
+
+    Rows are [event, ClientSet] pairs in event order, so code written for the legacy
+    [[event, [clients]]] lists (iteration, `matrix[idx][1]`, unpacking) keeps working,
+    while add/merge/removal go through an event index instead of scanning the rows.
+    """
+
+    __slots__ = ("_rows", "_index")
+
+    def __init__(self, events=()):
+        self._rows = []
+        self._index = {}
+        for event in events:
+            self._append_row(event, ())
+
+    @classmethod
+    def from_list(cls, matrix):
+        """Builds a ClientMatrix from legacy [[event, [clients]]] rows (or another ClientMatrix)."""
+        client_matrix = cls()
+        for event, clients in matrix:
+            client_matrix._append_row(event, clients)
+        return client_matrix
+
+    def _append_row(self, event, clients):
+        self._index.setdefault(event, []).append(len(self._rows))
+        self._rows.append([event, ClientSet(clients)])
+
+    def _reindex(self):
+        self._index = {}
+        for row_idx, (event, _) in enumerate(self._rows):
+            self._index.setdefault(event, []).append(row_idx)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __getitem__(self, row_idx):
+        return self._rows[row_idx]
+
+    def __contains__(self, event):
+        return event in self._index
+
+    def __repr__(self):
+        return f"ClientMatrix({self.to_list()!r})"
+
+    @property
+    def events(self):
+        return [event for event, _ in self._rows]
+
+    def clients(self, event):
+        """Clients of the first row of event (empty list if the event is unknown)."""
+        row_indexes = self._index.get(event)
+        return list(self._rows[row_indexes[0]][1]) if row_indexes else []
+
+    def add(self, event, client):
+        """Adds client to every row of event. Returns False (and does nothing) if event is unknown."""
+        row_indexes = self._index.get(event)
+        if not row_indexes:
+            return False
+        client = _intern(client)
+        for row_idx in row_indexes:
+            self._rows[row_idx][1][client] = None
+        return True
+
+    def update(self, event, clients):
+        """Adds several clients to every row of event. Returns False if event is unknown."""
+        row_indexes = self._index.get(event)
+        if not row_indexes:
+            return False
+        for row_idx in row_indexes:
+            self._rows[row_idx][1].update_clients(clients)
+        return True
+
+    def update_row(self, row_idx, clients):
+        self._rows[row_idx][1].update_clients(clients)
+
+    def merge(self, other):
+        """Adds the clients of every event of other (a ClientMatrix or legacy rows) that exists here."""
+        for event, clients in other:
+            self.update(event, clients)
+        return self
+
+    def remove_titles(self, titles):
+        """Removes, in place, the rows whose event is in titles."""
+        titles = set(titles)
+        if titles.isdisjoint(self._index):
+            return self
+        self._rows = [row for row in self._rows if row[0] not in titles]
+        self._reindex()
+        return self
+
+    def sort_clients(self):
+        for row in self._rows:
+            row[1] = ClientSet(sorted(row[1]))
+        return self
+
+    def to_list(self):
+        """Legacy [[event, [clients]]] export."""
+        return [[event, list(clients)] for event, clients in self._rows]
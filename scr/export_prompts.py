@@ -0,0 +1,81 @@
+import argparse
+import io
+import json
+import sys
+import zipfile
+
+from scr.extract_CRM_portfolio import compare_section_formats
+from scr.section_store import get_section_store
+
+
+def iter_section_prompts(store, titres):
+    """Yields (section_idx, prompt) for every section of the store, in order."""
+    for section_idx in range(len(store)):
+        yield section_idx, store.prompt(titres, section_idx)
+
+
+def iter_prompts_ndjson(store, titres):
+    """One JSON line per section prompt: {"section": idx, "prompt": "..."}."""
+    for section_idx, prompt in iter_section_prompts(store, titres):
+        yield json.dumps({"section": section_idx, "prompt": prompt}, ensure_ascii=False) + "\n"
+
+
+def write_prompts_zip(store, titres, fileobj):
+    """Writes one section_<n>.txt per section prompt into a zip archive."""
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for section_idx, prompt in iter_section_prompts(store, titres):
+            archive.writestr(f"section_{section_idx + 1:03d}.txt", prompt)
+
+
+def prompts_zip_bytes(store, titres):
+    buffer = io.BytesIO()
+    write_prompts_zip(store, titres, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def read_titles(path):
+    """Titles from a JSON list, or from a text file with one title per line."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return [line.strip() for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporte les prompts de toutes les sections.")
+    parser.add_argument("sections_json", help="clients_sections.json")
+    parser.add_argument("news_md", help="Newsletter (ou résumé) en Markdown")
+    parser.add_argument("titles", help="Titres : liste JSON ou un titre par ligne")
+    parser.add_argument("--format", choices=["ndjson", "zip"], default="ndjson")
+    parser.add_argument("--output", help="Fichier de sortie (sortie standard par défaut pour ndjson)")
+    parser.add_argument("--compare-formats", action="store_true",
+                        help="Affiche la taille et le débit des formats tableau et compact, sans exporter")
+    parser.add_argument("--compact", action="store_true", help="Tables clients compactes (identifiants d'instruments)")
+    args = parser.parse_args(argv)
+
+    store = get_section_store(args.sections_json, args.news_md, compact=args.compact)
+    if args.compare_formats:
+        comparison = compare_section_formats(store.sections)
+        for name in ("table", "compact"):
+            stats = comparison[name]
+            print(f"{name:<8} {stats['chars']:>10} caractères  ~{stats['tokens']:>8} tokens  "
+                  f"{stats['sections_per_second']:>10.0f} sections/s")
+        print(f"Réduction : x{comparison['size_ratio']:.1f}")
+        return
+    titres = read_titles(args.titles)
+
+    if args.format == "zip":
+        if not args.output:
+            parser.error("--output est obligatoire avec --format zip")
+        with open(args.output, "wb") as f:
+            write_prompts_zip(store, titres, f)
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.writelines(iter_prompts_ndjson(store, titres))
+    else:
+        sys.stdout.writelines(iter_prompts_ndjson(store, titres))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,80 @@
 import pandas as pd
-from collections import Counter
+from collections import Counter, OrderedDict
+import hashlib
 import json
+import os
+import threading
+import time
+from werkzeug.utils import secure_filename
 
-def list_action_clients(conseiller: str, fichier_xlsx: str):
-    df = pd.read_excel(fichier_xlsx)
-    df_filtered = df[df['CONSEILLER'] == conseiller]
-    df_filtered = df_filtered[df_filtered['CODE ISIN'].notna()]
+from scr.client_matrix import ClientMatrix
+from scr.metrics import timed
+
+CRM_COLUMNS = ['CONSEILLER', 'Portfolio', 'CODE ISIN', 'INSTRUMENT', 'INSTRUMENT.1',
+               'EMMETEUR', 'EMMETEUR/PAYS DE RESIDENCE']
+CRM_CACHE_DIR = "data/cache"
+CRM_FRAMES_MAX = 2
+
+_crm_frames = OrderedDict()
+_crm_frames_lock = threading.Lock()
+
+CLIENT_COLUMNS = ['Portfolio', 'INSTRUMENTS_DATA', 'Countries_Summary', 'Instruments_Summary']
+
+def _column_values(df, column, default=None):
+    """Values of `column` as a Python list, with missing cells (or a missing column) set to `default`."""
+    if column not in df.columns:
+        return [default] * len(df)
+    values = df[column].astype(object)
+    return values.where(values.notna(), default).tolist()
+
+@timed("client_table", lambda clients: {"clients": len(clients)})
+def clients_from_frame(df_conseiller, instrument_limit=100):
+    """
+    Builds the per-portfolio client table from the CRM rows of one advisor.
+
+    Every row is visited once: portfolios are keyed in order of first appearance and
+    the instruments list and the sector/country counters are filled in the same pass.
+    Rows without a Portfolio are skipped: the former per-portfolio loop turned them into
+    a client numbered NaN with no instrument, which json.dump then wrote as invalid JSON.
+
+    Args:
+        df_conseiller (DataFrame): CRM rows of a single advisor.
+        instrument_limit (int): Portfolios holding more instruments are left out.
+
+    Returns:
+        DataFrame: One row per portfolio with the columns of CLIENT_COLUMNS.
+    """
+    df_conseiller = df_conseiller[df_conseiller['CODE ISIN'].notna()]
+
+    portfolios = {}
+    rows = zip(
+        df_conseiller['Portfolio'].tolist(),
+        _column_values(df_conseiller, 'INSTRUMENT', 'N/A'),
+        _column_values(df_conseiller, 'EMMETEUR', 'N/A'),
+        _column_values(df_conseiller, 'INSTRUMENT.1'),
+        _column_values(df_conseiller, 'EMMETEUR/PAYS DE RESIDENCE'),
+    )
+    for portfolio, instrument, emmeteur, secteur, pays in rows:
+        if pd.isna(portfolio):
+            continue
+        entry = portfolios.get(portfolio)
+        if entry is None:
+            entry = portfolios[portfolio] = ([], Counter(), Counter())
+        instruments_data, instruments_count, countries_count = entry
+        instruments_data.append({
+            'instrument': instrument,
+            'emmeteur': emmeteur,
+            'secteur': 'N/A' if secteur is None else secteur
+        })
+        if secteur is not None:
+            instruments_count[secteur] += 1
+        if pays is not None:
+            countries_count[pays] += 1
 
     results = []
-    for portfolio in df_filtered['Portfolio'].unique():
-        portfolio_data = df_filtered[df_filtered['Portfolio'] == portfolio]
-        instruments_data = []
-        for _, row in portfolio_data.iterrows():
-            secteur = row.get('INSTRUMENT.1', 'N/A')
-            if pd.isna(secteur): secteur = 'N/A'
-            instrument = row.get('INSTRUMENT', 'N/A')
-            if pd.isna(instrument): instrument = 'N/A'
-            emmeteur = row.get('EMMETEUR', 'N/A')
-            if pd.isna(emmeteur): emmeteur = 'N/A'
-            instruments_data.append({
-                'instrument': instrument,
-                'emmeteur': emmeteur,
-                'secteur': secteur
-            })
-
-        instruments_count = Counter(portfolio_data['INSTRUMENT.1'].dropna())
-        countries_count = Counter(portfolio_data['EMMETEUR/PAYS DE RESIDENCE'].dropna())
+    for portfolio, (instruments_data, instruments_count, countries_count) in portfolios.items():
+        if len(instruments_data) > instrument_limit:
+            continue
         instruments_str = ', '.join([f"{k}({v})" for k, v in instruments_count.items()])
         countries_str = ', '.join([f"{k}({v})" for k, v in countries_count.items()])
         results.append({
@@ -34,11 +83,87 @@ def list_action_clients(conseiller: str, fichier_xlsx: str):
             'Countries_Summary': countries_str,
             'Instruments_Summary': instruments_str
         })
+    return pd.DataFrame(results, columns=CLIENT_COLUMNS)
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    df_results = pd.DataFrame(results)
-    mask = df_results['INSTRUMENTS_DATA'].apply(len) <= 100
-    clients_moins_ou_egal_100 = df_results[mask].reset_index(drop=True)
-    return clients_moins_ou_egal_100
+@timed("crm_load", lambda df: {"rows": len(df)})
+def load_crm(fichier_xlsx, cache_dir=CRM_CACHE_DIR):
+    """
+    Loads the CRM workbook restricted to CRM_COLUMNS.
+
+    The workbook is parsed only once per content: the frame is kept in memory and
+    pickled under cache_dir, keyed by the SHA-256 of the file, so later calls (for
+    any advisor, in any process) skip openpyxl entirely. Only the CRM_FRAMES_MAX most
+    recently used frames stay in memory, and on disk only the CRM_FRAMES_MAX most
+    recent snapshots are kept.
+
+    Args:
+        fichier_xlsx (str): Path to the CRM Excel export.
+        cache_dir (str): Directory of the on-disk snapshots, None to disable it.
+
+    Returns:
+        DataFrame: The CRM rows with the columns of CRM_COLUMNS found in the workbook.
+    """
+    key = file_sha256(fichier_xlsx)
+    with _crm_frames_lock:
+        df = _crm_frames.get(key)
+        if df is not None:
+            _crm_frames.move_to_end(key)
+            return df
+
+    cache_path = os.path.join(cache_dir, f"crm_{key}.pkl") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        df = pd.read_pickle(cache_path)
+    else:
+        wanted = set(CRM_COLUMNS)
+        df = pd.read_excel(fichier_xlsx, usecols=lambda column: column in wanted)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, cache_path)
+            _prune_crm_snapshots(cache_dir, CRM_FRAMES_MAX)
+
+    with _crm_frames_lock:
+        _crm_frames[key] = df
+        while len(_crm_frames) > CRM_FRAMES_MAX:
+            _crm_frames.popitem(last=False)
+    return df
+
+def _prune_crm_snapshots(cache_dir, keep):
+    """Deletes the CRM snapshots of cache_dir beyond the keep most recently written ones."""
+    snapshots = []
+    for name in os.listdir(cache_dir):
+        if name.startswith("crm_") and name.endswith(".pkl"):
+            path = os.path.join(cache_dir, name)
+            try:
+                snapshots.append((os.stat(path).st_mtime_ns, path))
+            except OSError:  # removed meanwhile by another process
+                pass
+    snapshots.sort()
+    for _, path in snapshots[:max(len(snapshots) - keep, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def advisor_slug(conseiller):
+    """
+    File name part for an advisor's files: secure_filename of the name plus a short hash
+    of the raw name, so 'JEAN-MARC X' and 'JEAN MARC X' never share a file.
+    """
+    digest = hashlib.sha256(str(conseiller).encode("utf-8")).hexdigest()[:8]
+    return f"{secure_filename(str(conseiller)) or 'sans_nom'}_{digest}"
+
+def list_action_clients(conseiller: str, fichier_xlsx: str):
+    df = load_crm(fichier_xlsx)
+    return clients_from_frame(df[df['CONSEILLER'] == conseiller])
 
 def grouped_clients_json(clients_moins_100, instrument_limit=100):
     idx = 0
@@ -66,34 +191,235 @@ def grouped_clients_json(clients_moins_100, instrument_limit=100):
             "clients": []
         }
         for client in current_section:
-            numero_client = client['Portfolio']
-            client_dict = {
-                "client_number": numero_client,
-                "instruments": client['INSTRUMENTS_DATA'],
-                "instruments_summary": client['Instruments_Summary'],
-                "countries_summary": client['Countries_Summary']
-            }
-            section_dict["clients"].append(client_dict)
+            section_dict["clients"].append(_client_dict(client))
         sections.append(section_dict)
         section_num += 1
     return sections
 
-def json_file(conseiller, fichier_xlsx):
+def _client_dict(client):
+    return {
+        "client_number": client['Portfolio'],
+        "instruments": client['INSTRUMENTS_DATA'],
+        "instruments_summary": client['Instruments_Summary'],
+        "countries_summary": client['Countries_Summary']
+    }
+
+def estimate_tokens(text):
+    """Rough token count of a prompt fragment (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+def client_tokens(client):
+    """Estimated tokens of a client's block in a section prompt (see render_client_lines)."""
+    return estimate_tokens("\n".join(render_client_lines(client)) + "\n")
+
+def section_header_tokens():
+    return estimate_tokens(render_section_header({"section": 0, "total_instruments": 0, "total_clients": 0}))
+
+def section_tokens(section):
+    """Estimated tokens of a section's client table, as counted by pack_clients_by_tokens."""
+    return section_header_tokens() + sum(client_tokens(client) for client in section["clients"])
+
+def pack_clients_by_tokens(clients_moins_100, token_budget, prompt_overhead=0):
+    """
+    Packs clients into sections so that each section prompt fits in token_budget.
+
+    Each client's footprint is the estimated token count of its rendered block (see
+    render_client_lines); clients are then placed first-fit-decreasing. Inside a section
+    clients keep their original order. A client too large for an empty section gets a
+    section of its own.
+
+    Args:
+        clients_moins_100 (DataFrame): Output of list_action_clients.
+        token_budget (int): Maximum estimated tokens of one complete association prompt.
+        prompt_overhead (int): Tokens of the prompt outside the client tables
+            (see association_prompt_overhead).
+
+    Returns:
+        list: Sections in the format of grouped_clients_json, with two extra keys:
+            "estimated_tokens" (whole prompt) and "fill_ratio" (estimated_tokens / token_budget).
+    """
+    clients = [_client_dict(client) for _, client in clients_moins_100.iterrows()]
+    footprints = [client_tokens(client) for client in clients]
+    header_tokens = section_header_tokens()
+    capacity = token_budget - prompt_overhead - header_tokens
+
+    bins = []  # [used tokens, [client indexes]]
+    for i in sorted(range(len(clients)), key=lambda i: -footprints[i]):
+        for packed in bins:
+            if packed[0] + footprints[i] <= capacity:
+                packed[0] += footprints[i]
+                packed[1].append(i)
+                break
+        else:
+            bins.append([footprints[i], [i]])
+
+    sections = []
+    for section_num, (used, members) in enumerate(bins, start=1):
+        members.sort()
+        section_clients = [clients[i] for i in members]
+        estimated = prompt_overhead + header_tokens + used
+        sections.append({
+            "section": section_num,
+            "total_instruments": sum(len(client["instruments"]) for client in section_clients),
+            "total_clients": len(section_clients),
+            "clients": section_clients,
+            "estimated_tokens": estimated,
+            "fill_ratio": round(estimated / token_budget, 3)
+        })
+    return sections
+
+def write_sections_json(sections, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sections, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, output_path)
+
+@timed("sectioning", lambda sections: {"sections": len(sections)})
+def build_sections(clients_moins_100, token_budget=None, prompt_overhead=0, instrument_limit=100):
+    """
+    Sections of an advisor's clients: cut every instrument_limit instruments, or packed
+    under token_budget estimated prompt tokens when it is given (see pack_clients_by_tokens).
+    """
+    if not token_budget:
+        return grouped_clients_json(clients_moins_100, instrument_limit=instrument_limit)
+    return pack_clients_by_tokens(clients_moins_100, token_budget, prompt_overhead)
+
+def json_file(conseiller, fichier_xlsx, output_path="data/clients_sections.json", token_budget=None, prompt_overhead=0):
+    """Writes the client sections of one advisor to output_path (see build_sections)."""
     try:
         clients_moins_100 = list_action_clients(
             conseiller,
             fichier_xlsx
         )
-        sections = grouped_clients_json(clients_moins_100, instrument_limit=100)
-        with open("data/clients_sections.json", "w", encoding="utf-8") as f:
-            json.dump(sections, f, ensure_ascii=False, indent=2)
-        print("JSON file 'data/clients_sections.json' created successfully.")
+        sections = build_sections(clients_moins_100, token_budget, prompt_overhead)
+        write_sections_json(sections, output_path)
+        print(f"JSON file '{output_path}' created successfully.")
 
     except FileNotFoundError:
         print("Erreur : Le fichier Excel n'a pas été trouvé")
     except Exception as e:
         print(f"Une erreur s'est produite : {str(e)}")
 
+def portfolio_fingerprints(df_conseiller):
+    """
+    SHA-1 of the sorted holdings of each portfolio of one advisor: every (ISIN, instrument,
+    issuer, sector, country) row, so any change that alters the client's prompt changes it.
+    """
+    df_conseiller = df_conseiller[df_conseiller['CODE ISIN'].notna()]
+    holdings = {}
+    rows = zip(
+        df_conseiller['Portfolio'].tolist(),
+        *(_column_values(df_conseiller, column) for column in CRM_COLUMNS[2:])
+    )
+    for portfolio, *holding in rows:
+        if pd.isna(portfolio):
+            continue
+        holdings.setdefault(portfolio, []).append(tuple(str(value) for value in holding))
+    return {
+        str(portfolio): hashlib.sha1(json.dumps(sorted(rows), ensure_ascii=False).encode("utf-8")).hexdigest()
+        for portfolio, rows in holdings.items()
+    }
+
+def sectioning_settings(token_budget=None, instrument_limit=100):
+    """
+    The build_sections parameters a snapshot was made with. prompt_overhead is left out:
+    it follows the newsletter digest, and kept sections are checked against it anyway.
+    """
+    if token_budget:
+        return {"token_budget": token_budget}
+    return {"instrument_limit": instrument_limit}
+
+def sections_snapshot(fingerprints, sections, token_budget=None, prompt_overhead=0, instrument_limit=100):
+    """Snapshot read back by incremental_sections on the next run."""
+    return {
+        "settings": sectioning_settings(token_budget, instrument_limit),
+        "fingerprints": fingerprints,
+        "sections": sections,
+    }
+
+def _reusable_section(section, token_budget, prompt_overhead, instrument_limit):
+    """Copy of a previous section if it still fits the current limits, else None."""
+    if not token_budget:
+        fits = len(section["clients"]) == 1 or section["total_instruments"] <= instrument_limit
+        return dict(section) if fits else None
+    tokens = section_tokens(section)
+    if len(section["clients"]) > 1 and tokens > token_budget - prompt_overhead:
+        return None
+    estimated = prompt_overhead + tokens
+    return dict(section, estimated_tokens=estimated, fill_ratio=round(estimated / token_budget, 3))
+
+@timed("incremental_sectioning", lambda result: {"kept_sections": result[1]["kept_sections"],
+                                                 "rebuilt_sections": result[1]["rebuilt_sections"]})
+def incremental_sections(clients_moins_100, fingerprints, previous=None, token_budget=None, prompt_overhead=0,
+                         instrument_limit=100):
+    """
+    Rebuilds only the sections touched by holdings changes since the previous snapshot.
+
+    Previous sections whose clients all still exist with the same fingerprint are kept
+    unchanged (same number, same content, hence the same prompt and cached answer), as
+    long as the snapshot was built with the same token_budget (or instrument_limit) and
+    the section still fits it after the current prompt_overhead, which changes with each
+    newsletter; their estimated_tokens and fill_ratio are computed again. The clients of the other sections, plus new or changed
+    clients, are packed again with build_sections into sections numbered after the kept ones.
+
+    Args:
+        clients_moins_100 (DataFrame): Output of list_action_clients.
+        fingerprints (dict): portfolio_fingerprints of the current export.
+        previous (dict): Previous snapshot (see sections_snapshot), or None.
+
+    Returns:
+        tuple: (sections, report) where report counts kept/rebuilt sections and changed clients.
+    """
+    previous = previous or {"fingerprints": {}, "sections": []}
+    old_fingerprints = previous["fingerprints"]
+    current = set(str(portfolio) for portfolio in clients_moins_100['Portfolio'])
+    unchanged = {portfolio for portfolio in current
+                 if portfolio in old_fingerprints and old_fingerprints[portfolio] == fingerprints.get(portfolio)}
+
+    kept = []
+    if previous.get("settings") == sectioning_settings(token_budget, instrument_limit):
+        for section in previous["sections"]:
+            if all(str(client["client_number"]) in unchanged for client in section["clients"]):
+                section = _reusable_section(section, token_budget, prompt_overhead, instrument_limit)
+                if section is not None:
+                    kept.append(section)
+    placed = {str(client["client_number"]) for section in kept for client in section["clients"]}
+
+    to_pack = clients_moins_100[~clients_moins_100['Portfolio'].astype(str).isin(placed)]
+    rebuilt = build_sections(to_pack, token_budget, prompt_overhead, instrument_limit) if len(to_pack) else []
+    next_number = max((section["section"] for section in kept), default=0) + 1
+    for offset, section in enumerate(rebuilt):
+        section["section"] = next_number + offset
+
+    report = {
+        "kept_sections": len(kept),
+        "rebuilt_sections": len(rebuilt),
+        "changed_clients": len(current - unchanged),
+        "removed_clients": len(set(old_fingerprints) - current),
+    }
+    return kept + rebuilt, report
+
+def json_file_incremental(conseiller, fichier_xlsx, output_path, snapshot_path, token_budget=None, prompt_overhead=0):
+    """
+    Like json_file, but reuses the sections of the previous run stored in snapshot_path
+    for the clients whose holdings did not change (see incremental_sections).
+    Returns the report of incremental_sections.
+    """
+    df = load_crm(fichier_xlsx)
+    df_conseiller = df[df['CONSEILLER'] == conseiller]
+    clients_moins_100 = clients_from_frame(df_conseiller)
+    fingerprints = portfolio_fingerprints(df_conseiller)
+
+    previous = read_json(snapshot_path) if os.path.exists(snapshot_path) else None
+    sections, report = incremental_sections(clients_moins_100, fingerprints, previous, token_budget, prompt_overhead)
+
+    write_sections_json(sections, output_path)
+    write_sections_json(sections_snapshot(fingerprints, sections, token_budget, prompt_overhead), snapshot_path)
+    print(f"{report['kept_sections']} sections reprises, {report['rebuilt_sections']} reconstruites "
+          f"({report['changed_clients']} clients modifiés, {report['removed_clients']} supprimés)")
+    return report
+
 def count_sections_in_json(json_path):
     """
     Returns the number of sections in the JSON file generated by grouped_clients_json.
@@ -112,13 +438,14 @@ def read_json(path):
         data = json.load(f)
     return data
 
-def generate_prompt_for_section(json_path, section_idx):
+def generate_prompt_for_section(json_path, section_idx, compact=False):
     """
     Generate a clear LLM-friendly prompt string for the given section index from the JSON file.
 
     Args:
         json_path (str): Path to the JSON file (list of sections).
         section_idx (int): Index of the section (0-based).
+        compact (bool): Use render_section_compact instead of one table per client.
 
     Returns:
         str: The formatted prompt string for the section.
@@ -129,46 +456,119 @@ def generate_prompt_for_section(json_path, section_idx):
     if not (0 <= section_idx < len(sections)):
         return f"Section {section_idx+1} does not exist in this file."
 
-    section = sections[section_idx]
-    prompt_lines = []
-    prompt_lines.append(f"Section {section['section']} summary:")
-    prompt_lines.append(f"Total instruments: {section['total_instruments']}")
-    prompt_lines.append(f"Total clients: {section['total_clients']}")
-    prompt_lines.append("")  # Empty line
+    return render_section(sections[section_idx], compact=compact)
+
+def render_section_header(section):
+    return "\n".join([
+        f"Section {section['section']} summary:",
+        f"Total instruments: {section['total_instruments']}",
+        f"Total clients: {section['total_clients']}",
+        ""  # Empty line
+    ])
+
+def render_client_lines(client):
+    """Lines describing one client (instrument table and summaries) in a section prompt."""
+    client_lines = []
+    client_lines.append(f"Client number: {client['client_number']}")
+    client_lines.append("Instruments for this client:")
+    client_lines.append("| Instrument                        | Emmeteur                    | Secteur                              |")
+    client_lines.append("|-----------------------------------|-----------------------------|--------------------------------------|")
+    for inst in client["instruments"]:
+        instrument = inst.get("instrument", "")[:33]
+        emmeteur = inst.get("emmeteur", "")[:27]
+        secteur = inst.get("secteur", "")[:36]
+        client_lines.append(f"| {instrument:<33} | {emmeteur:<27} | {secteur:<36} |")
+    # Add summaries if available
+    if "instruments_summary" in client:
+        client_lines.append(f"Instruments summary: {client['instruments_summary']}")
+    if "countries_summary" in client:
+        client_lines.append(f"Countries summary: {client['countries_summary']}")
+    client_lines.append("")  # Blank line after each client
+    return client_lines
+
+@timed("section_render", lambda text: {"chars": len(text)})
+def render_section(section, compact=False):
+    if compact:
+        return render_section_compact(section)
+    prompt_lines = [render_section_header(section)]
+    for client in section["clients"]:
+        prompt_lines.extend(render_client_lines(client))
+    return "\n".join(prompt_lines)
 
+def render_section_compact(section):
+    """
+    Compact rendering of a section: every distinct instrument is listed once, grouped by
+    sector, under a short ID (I1, I2...), and each client is the list of its instrument IDs.
+    Carries the same instruments, issuers, sectors and summaries as render_section.
+    """
+    by_sector = {}
     for client in section["clients"]:
-        client_number = client["client_number"]
-        prompt_lines.append(f"Client number: {client_number}")
-        prompt_lines.append("Instruments for this client:")
-        prompt_lines.append("| Instrument                        | Emmeteur                    | Secteur                              |")
-        prompt_lines.append("|-----------------------------------|-----------------------------|--------------------------------------|")
         for inst in client["instruments"]:
-            instrument = inst.get("instrument", "")[:33]
-            emmeteur = inst.get("emmeteur", "")[:27]
-            secteur = inst.get("secteur", "")[:36]
-            prompt_lines.append(f"| {instrument:<33} | {emmeteur:<27} | {secteur:<36} |")
-        # Add summaries if available
+            key = (inst.get("instrument", ""), inst.get("emmeteur", ""), inst.get("secteur", ""))
+            by_sector.setdefault(key[2], {})[key] = None
+    ids = {key: f"I{number}" for number, key in
+           enumerate((key for keys in by_sector.values() for key in keys), start=1)}
+
+    prompt_lines = [render_section_header(section)]
+    prompt_lines.append("Instruments by sector (ID | Instrument | Emmeteur):")
+    for secteur, keys in by_sector.items():
+        prompt_lines.append(f"## {secteur or '-'}")
+        prompt_lines.extend(f"{ids[key]} | {key[0]} | {key[1]}" for key in keys)
+    prompt_lines.append("")
+    prompt_lines.append("Clients (instrument IDs; instruments summary; countries summary):")
+    for client in section["clients"]:
+        held = ", ".join(ids[(inst.get("instrument", ""), inst.get("emmeteur", ""), inst.get("secteur", ""))]
+                         for inst in client["instruments"])
+        line = f"{client['client_number']}: {held}"
         if "instruments_summary" in client:
-            prompt_lines.append(f"Instruments summary: {client['instruments_summary']}")
+            line += f"; {client['instruments_summary']}"
         if "countries_summary" in client:
-            prompt_lines.append(f"Countries summary: {client['countries_summary']}")
-        prompt_lines.append("")  # Blank line after each client
+            line += f"; {client['countries_summary']}"
+        prompt_lines.append(line)
+    return "\n".join(prompt_lines)
 
+def compare_section_formats(sections, repeat=5):
+    """
+    Size and rendering throughput of the table and compact formats over the same sections.
 
-    return "\n".join(prompt_lines)
+    Returns:
+        dict: Per format, total characters, estimated tokens and sections rendered per
+        second, plus the table/compact size ratio.
+    """
+    comparison = {}
+    for name, compact in (("table", False), ("compact", True)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rendered = [render_section(section, compact=compact) for section in sections]
+        elapsed = time.perf_counter() - start
+        chars = sum(len(text) for text in rendered)
+        comparison[name] = {
+            "chars": chars,
+            "tokens": sum(estimate_tokens(text) for text in rendered),
+            "sections_per_second": len(sections) * repeat / elapsed if elapsed else float("inf"),
+        }
+    comparison["size_ratio"] = comparison["table"]["chars"] / max(comparison["compact"]["chars"], 1)
+    return comparison
 
-def prompt_association(titres, news_md_path, section_idx, json_path="../data/clients_sections.json"):
+def prompt_association(titres, news_md_path, section_idx, json_path="../data/clients_sections.json", compact=False):
     """
     titres: list of newsletter titles (strings)
     news_md_path: path to the markdown file containing the newsletter summary
     section_idx: index of the section in the JSON
     json_path: path to the JSON file containing client data
+    compact: compact client tables (see render_section_compact)
     Returns: the complete formatted prompt as a string
     """
-    extraction_client = generate_prompt_for_section(json_path, section_idx)
+    extraction_client = generate_prompt_for_section(json_path, section_idx, compact=compact)
     newsletter_resume = read_md_file(news_md_path)
+    return build_association_prompt(extraction_client, newsletter_resume, titres)
 
+def association_prompt_overhead(titres, news_md_path):
+    """Estimated tokens of an association prompt without any client table."""
+    return estimate_tokens(build_association_prompt("", read_md_file(news_md_path), titres))
 
+@timed("prompt_render", lambda prompt: {"chars": len(prompt)})
+def build_association_prompt(extraction_client, newsletter_resume, titres):
     prompt = f"""à partir de la liste des instruments d'un ou plusieurs clients et d'une newsletter , trouve les correspondances entre les instruments des clients et les titres de la newsletter.
 
 voici la liste des instruments des clients : 
@@ -204,31 +604,26 @@ résumer des secteurs intéressant pour les clients
 def associate_titles_with_clients(json_path, titles):
     """
     Reads the JSON file at json_path, which contains "all_lists" (a list of lists of client numbers),
-    and returns a list of [title, [client_numbers...]] for each title.
+    and returns the title -> clients matrix.
 
     - `titles`: list of newsletter titles, same order as in the prompt and as all_lists indices.
     - `json_path`: path to the JSON file with "all_lists".
 
     Returns:
-        result: list of [title, [all client numbers from all sections for that index]]
+        ClientMatrix: one [title, clients] row per title, with the sorted unique client
+        numbers found at that index in all sections.
     """
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
     all_lists = data["all_lists"]  # This is a list of lists, one per section
 
-    # Zip all_lists to group by title index across all sections
-    # Each element of grouped_lists will be a tuple of (section1_clients, section2_clients, ...) for title i
-    grouped_lists = list(zip(*all_lists))
-
-    result = []
-    for idx, title in enumerate(titles):
-        # Flatten all client lists for this title across sections and keep only unique client numbers
-        clients = set()
-        for client_group in grouped_lists[idx]:
-            clients.update(client_group)
-        result.append([title, sorted(clients)])
-    return result
+    matrix = ClientMatrix(titles)
+    for section_lists in all_lists:
+        for idx, clients in enumerate(section_lists[:len(titles)]):
+            matrix.update_row(idx, clients)
+    return matrix.sort_clients()
 
+@timed("final_prompt", lambda prompt: {"chars": len(prompt)})
 def prompt_final(titres, path_json, path_newsletter):
     newsletter = read_md_file(path_newsletter)
     commentaires = read_json(path_json)["all_summaries"]
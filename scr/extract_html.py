@@ -1,9 +1,44 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment, NavigableString
+from bs4.builder import HTMLTreeBuilder
+from lxml import etree
+import bisect
+import collections
+import hashlib
 import html2text
+import json
+import os
 import re
+import textwrap
+import threading
 import ast
 import unicodedata
 
+from scr.metrics import span, timed
+from scr.title_matcher import TitleMatcher
+
+
+TABLE_PLACEHOLDER = '___MARKDOWN_TABLE_PLACEHOLDER___'
+
+def table_to_markdown(table):
+    """Converts the two-column rows of an HTML table to a Markdown table ('' if there are none)."""
+    md = ""
+    rows = []
+    for tr in table.find_all('tr'):
+        tds = tr.find_all('td')
+        if len(tds) == 2:
+            left = tds[0].get_text(separator=' ', strip=True)
+            left = left.lstrip('·').strip()
+            right = tds[1].get_text(separator=' ', strip=True)
+            rows.append((left, right))
+    # Construire la table en Markdown
+    if rows:
+        md += '|  |  |\n| --- | --- |\n'
+        for left, right in rows:
+            left = left.replace('|', '\\|').strip()
+            right = right.replace('|', '\\|').strip()
+            md += f'| {left} | {right} |\n'
+        md += '|  |  |\n'
+    return md
 
 def extract_table_as_markdown(soup):
     """Find all tables and convert each to Markdown tables;
@@ -12,67 +47,395 @@ def extract_table_as_markdown(soup):
 
     # itérer sur toutes les tables
     for table in soup.find_all('table'):
-        md = ""
-        rows = []
-        for tr in table.find_all('tr'):
-            tds = tr.find_all('td')
-            if len(tds) == 2:
-                left = tds[0].get_text(separator=' ', strip=True)
-                left = left.lstrip('·').strip()
-                right = tds[1].get_text(separator=' ', strip=True)
-                rows.append((left, right))
-        # Construire la table en Markdown
-        if rows:
-            md += '|  |  |\n| --- | --- |\n'
-            for left, right in rows:
-                left = left.replace('|', '\\|').strip()
-                right = right.replace('|', '\\|').strip()
-                md += f'| {left} | {right} |\n'
-            md += '|  |  |\n'
+        md = table_to_markdown(table)
+        if md:
             all_tables_markdown.append(md)
         # Remplacer la table par un placeholder pour indiquer qu'elle a été traitée
-        table.replace_with('___MARKDOWN_TABLE_PLACEHOLDER___')
+        table.replace_with(TABLE_PLACEHOLDER)
 
     return soup, all_tables_markdown
 
 def html_to_markdown_with_table(input_html_path, output_md_path):
-    with open(input_html_path, 'r', encoding='utf-8') as f:
-        html = f.read()
-    soup = BeautifulSoup(html, 'html.parser')
-    # Use the updated function that processes all tables
-    soup, md_tables = extract_table_as_markdown(soup)
-    html_with_placeholder = str(soup)
-    md = html2text.html2text(html_with_placeholder)
-    # Replace each placeholder with the corresponding Markdown table in order
-    for md_table in md_tables:
-        md = md.replace('___MARKDOWN_TABLE_PLACEHOLDER___', md_table, 1)
-    with open(output_md_path, 'w', encoding='utf-8') as f:
-        f.write(md)
+    with open(input_html_path, "r", encoding="utf-8") as src, \
+            open(output_md_path, "w", encoding="utf-8") as dst:
+        stream_markdown(src, dst)
 
+# Streaming conversion (see MarkdownStream)
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+CDATA_LIST_ATTRIBUTES = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+EMPTY_ELEMENT_TAGS = HTMLTreeBuilder.empty_element_tags
+PRESERVE_WHITESPACE_TAGS = HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS
+STRING_CONTAINER_TAGS = set(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+RAW_TEXT_TAGS = ('script', 'style')
+NONWHITESPACE = re.compile(r'\S+')
+MARKUP_CHARS = re.compile(r'[&<>]')
+MARKUP_ENTITIES = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+
+
+def _escape(text):
+    return MARKUP_CHARS.sub(lambda m: MARKUP_ENTITIES[m.group(0)], text)
 
-def smart_split_events(text):
-    # Step 1: Mask out all parenthesis sections so we never split inside them
-    parens = {}
-    def _mask_parens(m):
-        key = f"§§§{len(parens)}§§§"
-        parens[key] = m.group(0)
-        return key
 
-    # Mask all parenthesis content
-    masked_text = re.sub(r'\([^\)]*\)', _mask_parens, text)
+def _quoted_attribute(value):
+    value = _escape(value)
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', '&quot;') + '"'
 
-    # Now split on slashes that are NOT between digits (dates) or inside masked parenthesis
-    split_candidates = re.split(r'(?<!\d)\s*/\s*(?!\d)', masked_text)
 
-    # Restore parenthesis content
-    restored = []
-    for part in split_candidates:
-        for key, val in parens.items():
-            part = part.replace(key, val)
-        restored.append(part.strip())
+class _TableNode:
+    """
+    Element of a table kept aside by MarkdownStream, with the find_all / get_text
+    subset of bs4's Tag that table_to_markdown relies on.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.children = []  # _TableNode or (text, counted by get_text)
+
+    def find_all(self, name):
+        found = []
+        for child in self.children:
+            if isinstance(child, _TableNode):
+                if child.name == name:
+                    found.append(child)
+                found.extend(child.find_all(name))
+        return found
+
+    def _strings(self):
+        for child in self.children:
+            if isinstance(child, _TableNode):
+                yield from child._strings()
+            elif child[1]:
+                yield child[0]
+
+    def get_text(self, separator='', strip=False):
+        strings = self._strings()
+        if strip:
+            strings = (s.strip() for s in strings)
+            strings = (s for s in strings if s)
+        return separator.join(strings)
+
+
+class MarkdownStream:
+    """
+    Single-pass HTML to Markdown converter, same output as Newsletter.to_markdown().
+
+    Used as the target of an lxml HTMLParser fed chunk by chunk: each event is written
+    back the way str(soup) would serialize it and fed to html2text right away. A
+    top-level table is collected instead, converted with table_to_markdown when it
+    closes and stands in the text as TABLE_PLACEHOLDER. The html2text output is wrapped
+    line by line (its optwrap) and each placeholder is replaced by its table before
+    being written. Memory holds one table and the paragraph html2text is working on.
+    """
+
+    def __init__(self, writer, feed_size=16 * 1024):
+        self.writer = writer
+        self.feed_size = feed_size
+        self.chars = 0
+        self.tables = 0
+        self._h2t = html2text.HTML2Text(out=self._out, bodywidth=html2text.config.BODY_WIDTH)
+        self._html = []      # serialized HTML not fed to html2text yet
+        self._html_size = 0
+        self._text = []      # current string, as bs4 collects it
+        self._stack = []     # open tags
+        self._preserve = 0   # open <pre>/<textarea>
+        self._containers = 0  # open <script>/<style>/<template>/<rt>/<rp>
+        self._void = None    # start of an empty-element tag, until we know if it has contents
+        self._table = []     # open tags of the collected table
+        self._md_tables = collections.deque()
+        self._md = []        # html2text output not yet a full line
+        self._newlines = 0   # optwrap state
+
+    # lxml parser target
+
+    def start(self, tag, attrib):
+        self._end_data()
+        self._stack.append(tag)
+        self._preserve += tag in PRESERVE_WHITESPACE_TAGS
+        self._containers += tag in STRING_CONTAINER_TAGS
+        if self._table or tag == 'table':
+            node = _TableNode(tag)
+            if self._table:
+                self._table[-1].children.append(node)
+            self._table.append(node)
+            return
+        attrs = ''.join(f' {key}={_quoted_attribute(self._attribute_value(tag, key, value))}'
+                        for key, value in sorted(attrib.items()))
+        if tag in EMPTY_ELEMENT_TAGS:
+            self._void = f'<{tag}{attrs}'
+        else:
+            self._markup(f'<{tag}{attrs}>')
+
+    def end(self, tag):
+        self._end_data()
+        tag = self._stack.pop()
+        self._preserve -= tag in PRESERVE_WHITESPACE_TAGS
+        self._containers -= tag in STRING_CONTAINER_TAGS
+        if self._table:
+            table = self._table.pop()
+            if not self._table:
+                self._add_table(table)
+        elif self._void is not None:
+            void, self._void = self._void, None
+            self._markup(void + '/>')
+        else:
+            self._markup(f'</{tag}>')
+
+    def data(self, text):
+        self._text.append(text)
+
+    def comment(self, text):
+        self._end_data()
+        if not self._table:
+            self._markup(f'<!--{text}-->')
+
+    def pi(self, target, data):
+        self._end_data()
+        if not self._table:
+            self._markup(f'<?{target} {data}>')
+
+    def doctype(self, name, pubid, system):
+        self._end_data()
+        value = name or ''
+        if pubid is not None:
+            value += f' PUBLIC "{pubid}"'
+            if system is not None:
+                value += f' "{system}"'
+        elif system is not None:
+            value += f' SYSTEM "{system}"'
+        if not self._table:
+            self._write_html(f'<!DOCTYPE {value}>\n')
+
+    def close(self):
+        self._end_data()
+        self._feed()
+        h = self._h2t
+        # html2text's finish(), its output going through _out
+        h.close()
+        h.pbr()
+        h.o("", force="end")
+        self._write_lines(["".join(self._md)])
+        self._md = []
+
+    # HTML side
+
+    @staticmethod
+    def _attribute_value(tag, key, value):
+        if key in CDATA_LIST_ATTRIBUTES['*'] or key in CDATA_LIST_ATTRIBUTES.get(tag, ()):
+            return ' '.join(NONWHITESPACE.findall(value))
+        return value
+
+    def _end_data(self):
+        """Closes the current string (bs4's endData): whitespace-only strings shrink to one character."""
+        if not self._text:
+            return
+        text = ''.join(self._text)
+        self._text = []
+        if not self._preserve and not text.strip(ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        if self._table:
+            self._table[-1].children.append((text, not self._containers))
+        else:
+            self._write_html(text if self._stack and self._stack[-1] in RAW_TEXT_TAGS else _escape(text))
+
+    def _add_table(self, table):
+        for node in [table] + table.find_all('table'):
+            md = table_to_markdown(node)
+            if md:
+                self._md_tables.append(md)
+        self.tables += 1
+        self._write_html(TABLE_PLACEHOLDER)
+
+    def _write_html(self, html):
+        if self._void is not None:
+            self._html.append(self._void + '>')
+            self._void = None
+        self._html.append(html)
+        self._html_size += len(html)
+
+    def _markup(self, html):
+        self._write_html(html)
+        # Only feed after a tag: html2text would handle a text split across two feeds differently
+        if self._html_size >= self.feed_size:
+            self._feed()
+
+    def _feed(self):
+        self._h2t.feed(''.join(self._html))
+        self._html = []
+        self._html_size = 0
+
+    # Markdown side
+
+    def _out(self, s):
+        if s:
+            self._h2t.lastWasNL = s[-1] == "\n"
+        if "\n" not in s:
+            self._md.append(s)
+            return
+        lines = ("".join(self._md) + s).split("\n")
+        self._md = [lines.pop()]
+        self._write_lines(lines)
+
+    def _write_lines(self, lines):
+        h = self._h2t
+        result = ""
+        for para in lines:
+            para = para.replace("&nbsp_place_holder;", " ")
+            # html2text's optwrap, one paragraph at a time
+            if len(para) > 0:
+                if not html2text.utils.skipwrap(para, h.wrap_links, h.wrap_list_items):
+                    indent = ""
+                    if para.startswith("  " + h.ul_item_mark):
+                        indent = "    "
+                    elif para.startswith("> "):
+                        indent = "> "
+                    result += "\n".join(textwrap.wrap(para, h.body_width, break_long_words=False,
+                                                      subsequent_indent=indent))
+                    if para.endswith("  "):
+                        result += "  \n"
+                        self._newlines = 1
+                    elif indent:
+                        result += "\n"
+                        self._newlines = 1
+                    else:
+                        result += "\n\n"
+                        self._newlines = 2
+                elif not html2text.config.RE_SPACE.match(para):
+                    result += para + "\n"
+                    self._newlines = 1
+            elif self._newlines < 2:
+                result += "\n"
+                self._newlines += 1
+        if TABLE_PLACEHOLDER in result:
+            parts = result.split(TABLE_PLACEHOLDER)
+            result = parts[0]
+            for part in parts[1:]:
+                result += (self._md_tables.popleft() if self._md_tables else TABLE_PLACEHOLDER) + part
+        self.writer.write(result)
+        self.chars += len(result)
+
+
+def stream_markdown(html_file, writer, chunk_size=64 * 1024):
+    """
+    Converts the HTML read from html_file (text mode) to Markdown written to writer, in
+    one pass and chunk_size characters at a time. Returns the MarkdownStream.
+    """
+    converter = MarkdownStream(writer)
+    with span("markdown_stream") as counts:
+        parser = etree.HTMLParser(target=converter, strip_cdata=False, recover=True)
+        size = 0
+        rest = ''
+        for chunk in iter(lambda: html_file.read(chunk_size), ''):
+            if size == 0 and chunk.startswith('\ufeff'):
+                chunk = chunk[1:]
+            size += len(chunk)
+            # libxml2 may split a text or a character reference cut by a chunk boundary
+            # differently than in one piece: only feed up to the last tag end
+            chunk = rest + chunk
+            cut = chunk.rfind('>') + 1
+            rest = chunk[cut:]
+            if cut:
+                parser.feed(chunk[:cut])
+        if rest:
+            parser.feed(rest)
+        if size:
+            parser.close()
+        else:
+            converter.close()
+        counts.update(bytes=size, chars=converter.chars, tables=converter.tables)
+    return converter
+
+# Summary-cell tokenizer (see smart_split_events)
+PAREN_GROUP = re.compile(r'\([^\)]*\)')
+SLASH = re.compile(r'/')
+EVENT_START = re.compile(r'[A-ZÉÈÎ]')
+EVENT_CHARS = re.compile(r'[\w\s,.\'-:]+')
+RATING_MARK = re.compile(r'\([=+\-/]*\)')
+
+def _split_on_slashes(text):
+    """
+    Splits text on the slashes outside parentheses that are not between two digits,
+    eating the whitespace around them, in one pass. Same parts as
+    re.split(r'(?<!\\d)\\s*/\\s*(?!\\d)', ...) applied with every '(...)' group masked.
+    """
+    spans = [m.span() for m in PAREN_GROUP.finditer(text)]
+    n = len(text)
+    parts = []
+    part_start = 0
+    resume = 0  # where the split regex would resume searching
+    span_idx = 0
+    for slash in SLASH.finditer(text):
+        j = slash.start()
+        while span_idx < len(spans) and spans[span_idx][1] <= j:
+            span_idx += 1
+        if span_idx < len(spans) and spans[span_idx][0] < j:
+            continue  # inside a parenthesis group
+        # Leftmost start: the whitespace before the slash, unless it directly follows a digit
+        start = j
+        while start > resume and text[start - 1].isspace():
+            start -= 1
+        if start > 0 and text[start - 1].isdecimal():
+            if start == j:
+                continue
+            start += 1
+        # Greedy whitespace after the slash, giving one back if a digit follows
+        end = j + 1
+        while end < n and text[end].isspace():
+            end += 1
+        if end < n and text[end].isdecimal():
+            if end == j + 1:
+                continue
+            end -= 1
+        parts.append(text[part_start:start])
+        part_start = resume = end
+    parts.append(text[part_start:])
+    return parts
+
+def _split_smashed(event):
+    """
+    Events glued together in one part, e.g. 'Kering (=) Vodafone (+)': same matches as
+    re.findall(r'[A-ZÉÈÎ][\\w\\s,.\\'-:]*\\([=+\\-/]*\\)|[A-ZÉÈÎ][\\w\\s,.\\'-:]+(?: [A-Z][a-z]+)*', event)
+    without backtracking. An event starting at a capital runs to the last rating mark
+    '(=)', '(+/-)'... of its run of event characters, or else to the end of that run.
+    """
+    runs = [m.span() for m in EVENT_CHARS.finditer(event)]
+    run_starts = [start for start, _ in runs]
+    marks = [m.span() for m in RATING_MARK.finditer(event)]
+    mark_starts = [start for start, _ in marks]
+
+    subparts = []
+    pos = 0
+    while True:
+        capital = EVENT_START.search(event, pos)
+        if capital is None:
+            return subparts
+        p = capital.start()
+        run_end = runs[bisect.bisect_right(run_starts, p) - 1][1]
+        mark_idx = bisect.bisect_left(mark_starts, run_end) - 1
+        if mark_idx >= 0 and mark_starts[mark_idx] > p:
+            end = marks[mark_idx][1]
+        elif run_end >= p + 2:
+            end = run_end
+        else:
+            pos = p + 1
+            continue
+        subparts.append(event[p:end])
+        pos = end
+
+def smart_split_events(text):
+    """
+    Splits a summary cell into its events: on slashes outside parentheses and not
+    inside dates, then, for parts without a colon, into events glued together.
 
-    # Remove empty entries
-    events = [e for e in restored if e]
+    Same events as the former regex version (tests/test_smart_split_events.py), except
+    where its "§§§<n>§§§" masking of parentheses was wrong: a digit between two groups
+    as in "(=)(+)0(-)", or a literal "§§§0§§§" in the text.
+    """
+    events = [part.strip() for part in _split_on_slashes(text)]
+    events = [e for e in events if e]
 
     # If not actually split, just return
     if len(events) == 1:
@@ -85,8 +448,7 @@ def smart_split_events(text):
         if ':' in event:
             final_events.append(event.strip())
             continue
-        # Otherwise, try the regex
-        subparts = re.findall(r'[A-ZÉÈÎ][\w\s,.\'-:]*\([=+\-/]*\)|[A-ZÉÈÎ][\w\s,.\'-:]+(?: [A-Z][a-z]+)*', event)
+        subparts = _split_smashed(event)
         if subparts and len(subparts) > 1:
             final_events.extend([s.strip() for s in subparts if s.strip()])
         else:
@@ -94,143 +456,73 @@ def smart_split_events(text):
 
     return final_events
 
-def extract_events(html_path):
-    with open(html_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
+EVENTS_CACHE_DIR = "data/cache"
+# Bump whenever get_all_events (or smart_split_events) changes its output, so titles
+# cached by an older version are extracted again
+EVENTS_EXTRACTOR_VERSION = 2
+EVENTS_MEMO_MAX = 8
+_events_by_hash = collections.OrderedDict()
+_events_lock = threading.Lock()
 
-    sommaire_data = []
-    for tr in soup.find_all("tr"):
-        tds = tr.find_all("td")
-        if len(tds) != 2:
-            continue
-        # Extract section name, preferring bold text
-        section = tds[0].get_text(separator=" ", strip=True)
-        bold_section = tds[0].find(['b', 'strong'])
-        if bold_section:
-            section = bold_section.get_text(separator=" ", strip=True)
-
-        cell = tds[1]
-        cell_text = cell.get_text(separator=" ", strip=True)
+def html_sha256(html):
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
 
-        # Use the improved splitter
-        events = smart_split_events(cell_text)
-        # For single-event: try to get bold, else the whole text
-        if len(events) == 1:
-            bold = cell.find(['b', 'strong'])
-            if bold:
-                events = [bold.get_text(separator=" ", strip=True)]
-
-        # Only add if section or events non-empty
-        if section.strip() or any(e.strip() for e in events):
-            sommaire_data.append((section.strip(), [e.strip() for e in events if e.strip()]))
+def cached_events(html, cache_dir=EVENTS_CACHE_DIR, newsletter=None):
+    """
+    Titles of the newsletter (get_all_events), extracted once per HTML content: kept in
+    memory (the EVENTS_MEMO_MAX most recently used newsletters) and as JSON under
+    cache_dir (None to disable it), keyed by the SHA-256 of html and EVENTS_EXTRACTOR_VERSION.
+    newsletter is the already parsed Newsletter of html, if any, reused on a cache miss;
+    otherwise html is parsed only on a miss.
+    """
+    key = f"v{EVENTS_EXTRACTOR_VERSION}_{html_sha256(html)}"
+    with _events_lock:
+        events = _events_by_hash.get(key)
+        if events is not None:
+            _events_by_hash.move_to_end(key)
+            return list(events)
+
+    cache_path = os.path.join(cache_dir, f"events_{key}.json") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            events = json.load(f)
+    else:
+        events = (newsletter or Newsletter(html)).get_all_events()
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(events, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+    with _events_lock:
+        _events_by_hash[key] = events
+        while len(_events_by_hash) > EVENTS_MEMO_MAX:
+            _events_by_hash.popitem(last=False)
+    return list(events)
 
-    return sommaire_data
+def extract_events(html_path):
+    return Newsletter.from_file(html_path).extract_events()
 
 def get_all_events(html_path):
-    sommaire = extract_events(html_path)
-    list_events = []
-    for section, events in sommaire:
-
-        for event in events:
-            list_events.append((event))
-
-    return list_events
+    return Newsletter.from_file(html_path).get_all_events()
 
 def remove_titles_from_html(html_path, output_path, titre_NP):
     """
     Removes unwanted titles and their following content in the HTML.
-    - For each <p> whose full text (including inside nested tags) matches a title in titre_NP,
-      removes that <p> and all content up to and including the next <br> or <p> with only a line break.
+    See Newsletter.remove_titles.
     """
-    with open(html_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
-
-    normalized_titles = [t.lower().strip() for t in titre_NP]
-
-    def matches_title(text):
-        if not text:
-            return False
-        t = text.lower().strip()
-        # Remove punctuation for more robust match (optional)
-        for wanted in normalized_titles:
-            if t.startswith(wanted):
-                return True
-            # Also allow for the title being in the middle, e.g., "TELENOR ..." or "Telenor (=)"
-            if wanted in t:
-                return True
-        return False
-
-    paragraphs = soup.find_all("p")
-    to_remove = set()
-
-    for p in paragraphs:
-        full_text = p.get_text(separator=" ", strip=True)  # Get all inner text, spaces normalize
-        if matches_title(full_text):
-            # Mark this <p> and everything until next <br> or <p> that is a line break
-            to_remove.add(p)
-            next_node = p.find_next_sibling()
-            while next_node:
-                # Remove NavigableString that is just whitespace
-                if getattr(next_node, 'name', None) is None and str(next_node).strip() == '':
-                    _next = next_node.find_next_sibling()
-                    to_remove.add(next_node)
-                    next_node = _next
-                    continue
-                # Remove <br> or <p> that is just a line break
-                if getattr(next_node, 'name', None) == 'br':
-                    to_remove.add(next_node)
-                    break
-                if getattr(next_node, 'name', None) == 'p':
-                    node_text = next_node.get_text(separator=" ", strip=True).lower()
-                    if node_text in ["", "&nbsp;", "<o:p></o:p>"]:
-                        to_remove.add(next_node)
-                        break
-                to_remove.add(next_node)
-                next_node = next_node.find_next_sibling()
-
-    for node in to_remove:
-        try:
-            node.decompose()
-        except Exception:
-            try:
-                node.extract()
-            except Exception:
-                pass
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(str(soup))
+    newsletter = Newsletter.from_file(html_path)
+    newsletter.remove_titles(titre_NP)
+    newsletter.save(output_path)
 
 
 def remove_from_marker(filepath, marker="MARKETING ANALYSTE"):
     """
     Deletes everything in the HTML file from (and including) the first occurrence of marker onwards.
     """
-    with open(filepath, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
-
-    found = False
-    # Walk through all tags in document order
-    for tag in soup.find_all(True):
-        if found:
-            tag.decompose()
-            continue
-        if marker.lower() in tag.get_text(separator=" ", strip=True).lower():
-            # Remove this tag and everything after
-            found = True
-            tag.decompose()
-            # Remove all subsequent siblings of this tag's parent (if any)
-            parent = tag.parent
-            while parent is not None:
-                next_sibling = parent.find_next_sibling()
-                while next_sibling:
-                    to_remove = next_sibling
-                    next_sibling = next_sibling.find_next_sibling()
-                    to_remove.decompose()
-                parent = parent.parent
-            break  # Stop after the first match
-
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(str(soup))
+    newsletter = Newsletter.from_file(filepath)
+    newsletter.remove_from_marker(marker)
+    newsletter.save(filepath)
 
 
 def normalize(text):
@@ -239,30 +531,316 @@ def normalize(text):
     return ''.join([c for c in text if not unicodedata.combining(c)])
 
 def add_clients_after_titles(html_path, matrice, output_path):
-    with open(html_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
-
-    title_to_clients = {normalize(title): clients for title, clients in matrice if clients}
-
-    for p in soup.find_all("p"):
-        p_text = normalize(p.get_text(separator=" ", strip=True))
-        for title, clients in title_to_clients.items():
-            if p_text.startswith(title) and clients:
-                client_str = ', '.join(clients)
-                new_p = soup.new_tag("p", **{'class': 'MsoNormal'})
-                new_span = soup.new_tag(
-                    "span",
-                    style='font-size:8.0pt; color:#1E9BD7; font-family:"Arial",sans-serif'
-                )
-                new_span.string = f"Clients: {client_str}"
-                new_p.append(new_span)
-                p.insert_after(new_p)
-                print(f"Added clients for: {title}")  # Debug print
+    newsletter = Newsletter.from_file(html_path)
+    newsletter.add_clients_after_titles(matrice)
+    newsletter.save(output_path)
+
+
+class Newsletter:
+    """
+    An HTML newsletter parsed once (lxml backend) and kept in memory.
+
+    Event extraction, Markdown conversion, title removal and client injection all work
+    on the same tree; nothing is written to disk until save() / write_markdown().
+    """
+
+    def __init__(self, html):
+        with span("html_parse", bytes=len(html)):
+            self.soup = BeautifulSoup(html, "lxml")
+
+    @classmethod
+    def from_file(cls, html_path):
+        with open(html_path, "r", encoding="utf-8") as f:
+            return cls(f.read())
+
+    def html(self):
+        return str(self.soup)
+
+    def save(self, output_path):
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(self.html())
+
+    @timed("markdown_conversion", lambda md: {"chars": len(md)})
+    def to_markdown(self):
+        """Markdown of the newsletter, tables rendered by table_to_markdown. The tree is left untouched."""
+        md_tables = []
+        swapped = []
+        for table in self.soup.find_all('table'):
+            md = table_to_markdown(table)
+            if md:
+                md_tables.append(md)
+            placeholder = NavigableString(TABLE_PLACEHOLDER)
+            table.replace_with(placeholder)
+            swapped.append((placeholder, table))
+        html_with_placeholder = str(self.soup)
+        # Put the tables back, innermost first, so the tree can still be edited and saved
+        for placeholder, table in reversed(swapped):
+            placeholder.replace_with(table)
+
+        md = html2text.html2text(html_with_placeholder)
+        # Replace each placeholder with the corresponding Markdown table in order
+        for md_table in md_tables:
+            md = md.replace(TABLE_PLACEHOLDER, md_table, 1)
+        return md
+
+    def write_markdown(self, output_md_path):
+        with open(output_md_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_markdown())
+
+    def extract_events(self):
+        sommaire_data = []
+        for tr in self.soup.find_all("tr"):
+            tds = tr.find_all("td")
+            if len(tds) != 2:
+                continue
+            # Extract section name, preferring bold text
+            section = tds[0].get_text(separator=" ", strip=True)
+            bold_section = tds[0].find(['b', 'strong'])
+            if bold_section:
+                section = bold_section.get_text(separator=" ", strip=True)
+
+            cell = tds[1]
+            cell_text = cell.get_text(separator=" ", strip=True)
+
+            # Use the improved splitter
+            events = smart_split_events(cell_text)
+            # For single-event: try to get bold, else the whole text
+            if len(events) == 1:
+                bold = cell.find(['b', 'strong'])
+                if bold:
+                    events = [bold.get_text(separator=" ", strip=True)]
+
+            # Only add if section or events non-empty
+            if section.strip() or any(e.strip() for e in events):
+                sommaire_data.append((section.strip(), [e.strip() for e in events if e.strip()]))
+
+        return sommaire_data
+
+    @timed("title_extraction", lambda events: {"titles": len(events)})
+    def get_all_events(self):
+        list_events = []
+        for section, events in self.extract_events():
+            list_events.extend(events)
+        return list_events
+
+    def _sommaire_paragraphs(self):
+        """<p> of the two-cell rows read by extract_events (the table of contents)."""
+        return {id(p) for tr in self.soup.find_all("tr") if len(tr.find_all("td")) == 2
+                for p in tr.find_all("p")}
+
+    @timed("newsletter_digest", lambda text: {"chars": len(text)})
+    def digest(self, titles=None, chars_per_title=600):
+        """
+        Condensed Markdown of the newsletter: for each title, the text that follows it in the
+        body, cut to chars_per_title characters. Titles default to get_all_events().
+
+        Built once per newsletter and embedded in every section prompt instead of the full
+        Markdown. A title is located at the first paragraph outside the table of contents that
+        starts with it; its excerpt stops at the next title, heading (upper case) or blank
+        paragraph, like the blocks remove_titles deletes.
+        """
+        if titles is None:
+            titles = self.get_all_events()
+        normalized = [normalize(title) for title in titles]
+        matcher = TitleMatcher(normalized)
+        sommaire = self._sommaire_paragraphs()
+
+        title_paragraphs = {}  # title index -> first body paragraph starting with it
+        boundaries = set()  # paragraphs ending an excerpt: titles, headings and blank lines
+        for p in self.soup.find_all("p"):
+            if id(p) in sommaire:
+                continue
+            raw = p.get_text(separator=" ", strip=True)
+            if not raw or raw.isupper():
+                boundaries.add(id(p))
+            starts = matcher.prefixes(normalize(raw))
+            if not starts:
+                continue
+            boundaries.add(id(p))
+            for idx in starts:
+                if idx not in title_paragraphs and normalized[idx]:
+                    title_paragraphs[idx] = p
+
+        blocks = []
+        for idx, title in enumerate(titles):
+            p = title_paragraphs.get(idx)
+            excerpt = self._excerpt(p, boundaries, chars_per_title) if p is not None else ""
+            blocks.append(f"## {title}\n{excerpt}".rstrip())
+        return "\n\n".join(blocks) + "\n"
+
+    @staticmethod
+    def _excerpt(p, boundaries, chars_per_title):
+        parts = [p.get_text(separator=" ", strip=True)]
+        length = len(parts[0])
+        for element in p.next_elements:
+            if length >= chars_per_title:
+                break
+            if id(element) in boundaries:
                 break
+            if not isinstance(element, NavigableString) or isinstance(element, Comment):
+                continue
+            if element.parent is None or element.parent.name in ("style", "script", "title") or element.find_parent("p") is p:
+                continue
+            text = " ".join(element.split())
+            if text:
+                parts.append(text)
+                length += len(text) + 1
+        excerpt = " ".join(parts)
+        if len(excerpt) > chars_per_title:
+            excerpt = excerpt[:chars_per_title].rsplit(" ", 1)[0] + " …"
+        return excerpt
+
+    def write_digest(self, output_md_path, titles=None, chars_per_title=600):
+        with open(output_md_path, 'w', encoding='utf-8') as f:
+            f.write(self.digest(titles, chars_per_title))
+
+    def remove_titles(self, titre_NP):
+        """
+        For each <p> whose full text (including inside nested tags) matches a title in titre_NP,
+        removes that <p> and all content up to and including the next <br> or <p> with only a line break.
+        """
+        # A title may start the paragraph or sit in the middle, e.g., "TELENOR ..." or "Telenor (=)"
+        matcher = TitleMatcher([t.lower().strip() for t in titre_NP])
+
+        def matches_title(text):
+            if not text:
+                return False
+            return matcher.contains_any(text.lower().strip())
+
+        paragraphs = self.soup.find_all("p")
+        to_remove = set()
+
+        for p in paragraphs:
+            full_text = p.get_text(separator=" ", strip=True)  # Get all inner text, spaces normalize
+            if matches_title(full_text):
+                # Mark this <p> and everything until next <br> or <p> that is a line break
+                to_remove.add(p)
+                next_node = p.find_next_sibling()
+                while next_node:
+                    # Remove NavigableString that is just whitespace
+                    if getattr(next_node, 'name', None) is None and str(next_node).strip() == '':
+                        _next = next_node.find_next_sibling()
+                        to_remove.add(next_node)
+                        next_node = _next
+                        continue
+                    # Remove <br> or <p> that is just a line break
+                    if getattr(next_node, 'name', None) == 'br':
+                        to_remove.add(next_node)
+                        break
+                    if getattr(next_node, 'name', None) == 'p':
+                        node_text = next_node.get_text(separator=" ", strip=True).lower()
+                        if node_text in ["", "&nbsp;", "<o:p></o:p>"]:
+                            to_remove.add(next_node)
+                            break
+                    to_remove.add(next_node)
+                    next_node = next_node.find_next_sibling()
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(str(soup))
+        for node in to_remove:
+            try:
+                node.decompose()
+            except Exception:
+                try:
+                    node.extract()
+                except Exception:
+                    pass
+
+    def remove_from_marker(self, marker="MARKETING ANALYSTE"):
+        """
+        Deletes everything from (and including) the first occurrence of marker onwards:
+        the innermost element holding it, then everything after that element and after
+        each of its ancestors. The <html>/<body> lxml wraps every document in always
+        contain the marker, so taking the first matching tag would erase the whole input.
+        """
+        marker = marker.lower()
+
+        def contains_marker(tag):
+            return marker in tag.get_text(separator=" ", strip=True).lower()
+
+        tag = self.soup
+        while True:
+            child = next((child for child in tag.find_all(True, recursive=False) if contains_marker(child)), None)
+            if child is None:
+                break
+            tag = child
+        if tag is self.soup:  # marker not found
+            return
+        for node in [tag, *tag.parents]:
+            for sibling in list(node.next_siblings):
+                sibling.extract()
+        tag.decompose()
+
+    @timed("client_injection")
+    def add_clients_after_titles(self, matrice):
+        title_to_clients = {normalize(title): clients for title, clients in matrice if clients}
+        titles = list(title_to_clients)
+        matcher = TitleMatcher(titles)
+
+        for p in self.soup.find_all("p"):
+            p_text = normalize(p.get_text(separator=" ", strip=True))
+            title_idx = matcher.first_prefix(p_text)
+            if title_idx is None:
+                continue
+            title = titles[title_idx]
+            p.insert_after(self.client_paragraph(title_to_clients[title]))
+            print(f"Added clients for: {title}")  # Debug print
+
+    def client_paragraph(self, clients):
+        """The <p> listing clients that add_clients_after_titles puts under a title."""
+        client_str = ', '.join(clients)
+        new_p = self.soup.new_tag("p", **{'class': 'MsoNormal'})
+        new_span = self.soup.new_tag(
+            "span",
+            style='font-size:8.0pt; color:#1E9BD7; font-family:"Arial",sans-serif'
+        )
+        new_span.string = f"Clients: {client_str}"
+        new_p.append(new_span)
+        return new_p
+
+
+PARAGRAPH_CUT = re.compile(r'\x00(\d+)\x00')
+
+class ClientInjector:
+    """
+    A newsletter prepared once for add_clients_after_titles with many client matrices.
 
+    Paragraph texts are normalized and the HTML is serialized once, cut after every
+    paragraph. inject() then only matches the titles and joins the pieces around the
+    client paragraphs: same HTML as add_clients_after_titles followed by html(), without
+    parsing or copying the tree again. The newsletter must not change afterwards.
+    """
+
+    def __init__(self, newsletter):
+        self.newsletter = newsletter
+        paragraphs = newsletter.soup.find_all("p")
+        self.texts = [normalize(p.get_text(separator=" ", strip=True)) for p in paragraphs]
+        markers = []
+        for idx, p in enumerate(paragraphs):
+            marker = NavigableString(f"\x00{idx}\x00")
+            p.insert_after(marker)
+            markers.append(marker)
+        pieces = PARAGRAPH_CUT.split(newsletter.html())
+        for marker in markers:
+            marker.extract()
+        self._pieces = pieces[::2]
+        self._cuts = [int(idx) for idx in pieces[1::2]]  # paragraph ending before each piece
+
+    def inject(self, matrice):
+        """HTML of the newsletter with the clients of matrice ([[title, clients]]) under their titles."""
+        title_to_clients = {normalize(title): clients for title, clients in matrice if clients}
+        titles = list(title_to_clients)
+        matcher = TitleMatcher(titles)
+        added = {}
+        for idx, p_text in enumerate(self.texts):
+            title_idx = matcher.first_prefix(p_text)
+            if title_idx is not None:
+                added[idx] = str(self.newsletter.client_paragraph(title_to_clients[titles[title_idx]]))
+        html = [self._pieces[0]]
+        for idx, piece in zip(self._cuts, self._pieces[1:]):
+            html.append(added.get(idx, ""))
+            html.append(piece)
+        return "".join(html)
+
+@timed("response_parsing", lambda parsed: {"responses": 1, "titles": len(parsed[0])})
 def divisiontext(text):
     """
     Splits the input text (from the text zone) into a Python list and a summary string.
@@ -304,6 +882,34 @@ def divisiontext(text):
 
     return the_list, rest_str
 
+def process_responses(responses):
+    """
+    Parses the LLM answers of all sections with divisiontext.
+    Returns {"all_lists": [...], "all_summaries": [...]}, one entry per response (empty ones included).
+    """
+    return results_data([parse_response(response_text) for response_text in responses])
+
+def parse_response(response_text):
+    """divisiontext of one answer; ([], "") for an empty one."""
+    if response_text.strip():
+        return divisiontext(response_text)
+    return [], ""
+
+def complete_answer(parsed_response, nb_titles):
+    """
+    True when a parsed answer has one client list per title sent. Only those are worth
+    caching: divisiontext gives ([], whole text) for a truncated or garbled answer.
+    """
+    the_list, _ = parsed_response
+    return len(the_list) == nb_titles and all(isinstance(clients, list) for clients in the_list)
+
+def results_data(parsed_responses):
+    """{"all_lists", "all_summaries"} data from (the_list, summary) pairs."""
+    return {
+        "all_lists": [the_list for the_list, _ in parsed_responses],
+        "all_summaries": [the_summary for _, the_summary in parsed_responses]
+    }
+
 def extract_html():
     print("extract_html function is running")
     
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class Job:
+    """
+    A background run of the pipeline, split into named stages.
+
+    Each stage goes through pending -> running -> done (or error) and records its
+    duration, so the status endpoint can show progress while the job runs.
+    With a status_path, every change is also written there as JSON, so other
+    server processes can report on the job (see read_status).
+    """
+
+    def __init__(self, stages, job_id=None, status_path=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.status_path = status_path
+        self.status = "queued"
+        self.created = time.time()
+        self.stages = [{"name": name, "label": label, "status": "pending", "seconds": None}
+                       for name, label in stages]
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Marks stage `name` as running for the duration of the with-block."""
+        entry = next(entry for entry in self.stages if entry["name"] == name)
+        self._set(entry, status="running")
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self._set(entry, status="error", seconds=time.perf_counter() - start)
+            raise
+        self._set(entry, status="done", seconds=time.perf_counter() - start)
+
+    def _set(self, target=None, **fields):
+        """Updates the job (or one of its stage entries) and persists the new status."""
+        with self._lock:
+            if target is None:
+                for name, value in fields.items():
+                    setattr(self, name, value)
+            else:
+                target.update(fields)
+        self.save()
+
+    def save(self):
+        if not self.status_path:
+            return
+        tmp_path = f"{self.status_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.status_path)
+
+    @staticmethod
+    def read_status(status_path):
+        """Status saved by a Job (possibly running in another process), or None."""
+        try:
+            with open(status_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def to_dict(self):
+        with self._lock:
+            done = sum(1 for entry in self.stages if entry["status"] == "done")
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "progress": done / len(self.stages) if self.stages else 1.0,
+                "stages": [dict(entry) for entry in self.stages],
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobQueue:
+    """In-process job queue: jobs run on a thread pool and are kept in memory for status polling."""
+
+    def __init__(self, max_workers=2, max_jobs=200):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._max_jobs = max_jobs
+        self._lock = threading.Lock()
+
+    def submit(self, stages, func, *args, job_id=None, status_path=None, **kwargs):
+        """
+        Queues func(job, *args, **kwargs) and returns the Job right away.
+
+        Args:
+            stages (list): (name, label) pairs, in execution order.
+            func (callable): Runs the job; uses job.stage(name) around each stage and
+                returns the job result (must be JSON serializable).
+            job_id (str): Identifier of the job (a new one by default).
+            status_path (str): File where the job status is mirrored (see Job).
+        """
+        job = self._add(stages, job_id, status_path)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def run(self, stages, func, *args, job_id=None, status_path=None, **kwargs):
+        """Same as submit, but runs the job in the calling thread and returns it once finished."""
+        job = self._add(stages, job_id, status_path)
+        self._run(job, func, args, kwargs)
+        return job
+
+    def _add(self, stages, job_id, status_path):
+        job = Job(stages, job_id=job_id, status_path=status_path)
+        job.save()
+        with self._lock:
+            self._jobs[job.id] = job
+            # Forget the oldest finished jobs
+            if len(self._jobs) > self._max_jobs:
+                finished = [j for j in self._jobs.values() if j.status in ("done", "error")]
+                for old_job in sorted(finished, key=lambda j: j.created)[:len(self._jobs) - self._max_jobs]:
+                    del self._jobs[old_job.id]
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @staticmethod
+    def _run(job, func, args, kwargs):
+        job._set(status="running")
+        try:
+            result = func(job, *args, **kwargs)
+            job._set(result=result, status="done")
+        except Exception as e:
+            traceback.print_exc()
+            job._set(error=str(e), status="error")
@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+from scr.export_prompts import read_titles
+from scr.extract_html import complete_answer, parse_response, results_data
+from scr.prematch import InstrumentIndex, direct_matches_summary, merge_section_lists, split_titles
+from scr.response_cache import ResponseCache
+from scr.section_store import get_section_store
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Spaces request starts by at least 1 / requests_per_second seconds."""
+
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_start = 0.0
+        self._lock = None
+
+    async def wait(self):
+        if not self.interval:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_start = max(self._next_start, loop.time()) + self.interval
+
+
+class CompletionBackend:
+    """
+    Client of an OpenAI-compatible chat completion endpoint (llama.cpp, vLLM, Ollama,
+    or the offline stub of scr.llm_stub).
+
+    complete_all() sends many prompts concurrently: at most max_concurrency requests in
+    flight, starts spaced by the rate limit, and retryable failures (timeouts, 429, 5xx)
+    retried with exponential backoff.
+    """
+
+    def __init__(self, endpoint, model="local", api_key=None, timeout=300,
+                 max_concurrency=4, max_retries=3, backoff=1.0, requests_per_second=None):
+        self.endpoint = endpoint
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.requests_per_second = requests_per_second
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Backend configured by LLM_ENDPOINT, LLM_MODEL, LLM_API_KEY, LLM_MAX_CONCURRENCY and LLM_RPS."""
+        settings = {
+            "endpoint": os.environ.get("LLM_ENDPOINT"),
+            "model": os.environ.get("LLM_MODEL", "local"),
+            "api_key": os.environ.get("LLM_API_KEY"),
+            "max_concurrency": int(os.environ.get("LLM_MAX_CONCURRENCY", 4)),
+            "requests_per_second": float(os.environ["LLM_RPS"]) if os.environ.get("LLM_RPS") else None,
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+    def complete(self, prompt):
+        """Sends one prompt (blocking, no retry) and returns the completion text."""
+        payload = json.dumps({
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+        }).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(self.endpoint, data=payload, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = json.loads(response.read().decode("utf-8"))
+        return data["choices"][0]["message"]["content"]
+
+    async def _complete_with_retries(self, prompt, semaphore, limiter):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                # Spaced from the start of the previous request, not from entering the queue
+                await limiter.wait()
+                try:
+                    return await loop.run_in_executor(None, self.complete, prompt)
+                except urllib.error.HTTPError as e:
+                    if e.code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                        raise
+                except (urllib.error.URLError, TimeoutError, ConnectionError):
+                    if attempt == self.max_retries:
+                        raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def complete_all_async(self, prompts, return_exceptions=False):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiter = RateLimiter(self.requests_per_second)
+        return await asyncio.gather(*(self._complete_with_retries(prompt, semaphore, limiter)
+                                      for prompt in prompts), return_exceptions=return_exceptions)
+
+    def complete_all(self, prompts, return_exceptions=False):
+        """
+        Completions of all prompts, in the same order. With return_exceptions, a prompt
+        still failing after its retries gives its exception instead of failing them all.
+        """
+        return asyncio.run(self.complete_all_async(list(prompts), return_exceptions))
+
+
+def associate_sections(store, titres, backend, cache=None, index=None):
+    """
+    Sends the association prompt of every section of the store to the backend and parses
+    the answers with divisiontext. With a ResponseCache, sections whose exact prompt was
+    already answered are taken from the cache and only the others go to the backend.
+
+    With an InstrumentIndex, titles naming a held company are matched offline and the
+    prompts only ask about the remaining titles; when no title is left, or without a
+    backend (None), no LLM call is made. Returns the same {"all_lists", "all_summaries"}
+    data as /api/save_responses, with one list per title of titres, plus "failed_sections":
+    the indexes of the sections whose LLM call failed after its retries (they get an empty
+    answer, direct matches only) or whose answer has not one list per title sent. Only
+    complete answers are cached, so running again resends exactly those sections.
+    """
+    if index is None:
+        resolved, ambiguous = {}, list(range(len(titres)))
+    else:
+        resolved, ambiguous = split_titles(titres, index)
+    llm_titres = [titres[idx] for idx in ambiguous]
+
+    parsed = [([], "")] * len(store)
+    failed = []
+    if llm_titres and backend is not None:
+        prompts = [store.prompt(llm_titres, section_idx) for section_idx in range(len(store))]
+        parsed = [cache.get(prompt) if cache is not None else None for prompt in prompts]
+
+        missing = [idx for idx, result in enumerate(parsed) if result is None]
+        answers = backend.complete_all([prompts[idx] for idx in missing], return_exceptions=True) if missing else []
+        for idx, answer in zip(missing, answers):
+            if isinstance(answer, BaseException):
+                print(f"Section {idx + 1} : échec de l'appel au LLM ({answer!r})")
+                failed.append(idx)
+                parsed[idx] = ([], "")
+                continue
+            parsed[idx] = parse_response(answer)
+            if not complete_answer(parsed[idx], len(llm_titres)):
+                print(f"Section {idx + 1} : réponse du LLM illisible ou incomplète")
+                failed.append(idx)
+            elif cache is not None:
+                cache.put(prompts[idx], parsed[idx])
+
+    if not resolved:
+        return dict(results_data(parsed), failed_sections=failed)
+    merged = []
+    for section, (the_list, summary) in zip(store.sections, parsed):
+        section_clients = [client["client_number"] for client in section["clients"]]
+        full_list = merge_section_lists(len(titres), resolved, ambiguous, the_list, section_clients)
+        direct = direct_matches_summary(titres, full_list, resolved)
+        if direct:
+            summary = f"{summary}\n\nCorrespondances directes :\n{direct}".strip()
+        merged.append((full_list, summary))
+    return dict(results_data(merged), failed_sections=failed)
+
+
+def save_results(output_data, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(output_data, f, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Associe clients et titres via un LLM local, pour toutes les sections.")
+    parser.add_argument("sections_json", help="clients_sections.json")
+    parser.add_argument("news_md", help="Newsletter (ou résumé) en Markdown")
+    parser.add_argument("titles", help="Titres : liste JSON ou un titre par ligne")
+    parser.add_argument("--endpoint", default=os.environ.get("LLM_ENDPOINT", "http://127.0.0.1:8001/v1/chat/completions"))
+    parser.add_argument("--model", default=os.environ.get("LLM_MODEL", "local"))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rps", type=float, default=None, help="Requêtes par seconde au maximum")
+    parser.add_argument("--output", default="data/results_processed.json")
+    parser.add_argument("--no-cache", action="store_true", help="Ne pas utiliser le cache des réponses")
+    parser.add_argument("--no-prematch", action="store_true",
+                        help="Envoyer tous les titres au LLM, sans correspondance directe par nom d'émetteur")
+    parser.add_argument("--compact", action="store_true", help="Tables clients compactes (identifiants d'instruments)")
+    args = parser.parse_args(argv)
+
+    backend = CompletionBackend(args.endpoint, model=args.model, max_concurrency=args.concurrency,
+                                requests_per_second=args.rps)
+    store = get_section_store(args.sections_json, args.news_md, compact=args.compact)
+    cache = None if args.no_cache else ResponseCache()
+
+    titres = read_titles(args.titles)
+    index = None if args.no_prematch else InstrumentIndex.from_sections(store.sections)
+    if index is not None:
+        resolved, ambiguous = split_titles(titres, index)
+        print(f"{len(resolved)} titres résolus sans LLM, {len(ambiguous)} envoyés au LLM")
+
+    start = time.perf_counter()
+    output_data = associate_sections(store, titres, backend, cache, index)
+    save_results(output_data, args.output)
+    print(f"{len(output_data['all_lists'])} sections traitées en {time.perf_counter() - start:.2f}s -> {args.output}")
+    if output_data["failed_sections"]:
+        print(f"Sections en échec (à relancer) : {[idx + 1 for idx in output_data['failed_sections']]}")
+    if cache is not None:
+        print(f"Cache des réponses : {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
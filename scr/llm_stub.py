@@ -0,0 +1,106 @@
+import argparse
+import ast
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CLIENT_LINE = re.compile(r"^Client number: (.+)$")
+TITLES_MARKER = "Voici la liste des titres de la newsletter:"
+
+
+def parse_association_prompt(prompt):
+    """
+    Titles and per-client instrument text of an association prompt (see build_association_prompt).
+    Returns (titles, {client_number: lower-cased instrument table and summaries}).
+    """
+    titles = []
+    marker = prompt.find(TITLES_MARKER)
+    if marker != -1:
+        titles_line = prompt[marker + len(TITLES_MARKER):].strip().splitlines()[0]
+        try:
+            titles = ast.literal_eval(titles_line)
+        except (ValueError, SyntaxError):
+            titles = []
+
+    clients = {}
+    current = None
+    for line in prompt.splitlines():
+        match = CLIENT_LINE.match(line)
+        if match:
+            current = match.group(1).strip()
+            clients[current] = []
+        elif current is not None:
+            if not line.strip():
+                current = None
+            else:
+                clients[current].append(line.lower())
+    return titles, {client: "\n".join(lines) for client, lines in clients.items()}
+
+
+def stub_answer(prompt):
+    """
+    Deterministic answer in the format the association prompt asks for: a client is
+    associated with a title when the first word of the title appears in its instruments.
+    """
+    titles, clients = parse_association_prompt(prompt)
+    associations = []
+    for title in titles:
+        words = re.findall(r"\w{3,}", title.lower())
+        keyword = words[0] if words else None
+        associations.append([client for client, text in clients.items() if keyword and keyword in text])
+    matched = sum(1 for clients_for_title in associations if clients_for_title)
+    return f"{associations}\n---\n{matched} titres associés à au moins un client (réponse simulée)."
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length).decode("utf-8"))
+        prompt = payload["messages"][-1]["content"]
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({
+            "object": "chat.completion",
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": stub_answer(prompt)}}],
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0):
+    """
+    Starts the stub in a background thread (port 0 picks a free port).
+    Returns (server, endpoint URL); call server.shutdown() to stop it.
+    """
+    handler = type("StubHandler", (StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur LLM simulé (API chat completions) pour tester le pipeline hors ligne.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Délai simulé par requête (secondes)")
+    args = parser.parse_args(argv)
+
+    handler = type("StubHandler", (StubHandler,), {"latency": args.latency})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"LLM simulé sur http://{args.host}:{args.port}/v1/chat/completions")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
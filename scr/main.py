@@ -1,94 +1,146 @@
 from scr import extract_CRM_portfolio
+import json
 import re
-from scr.extract_html import get_all_events
-from scr.extract_html import html_to_markdown_with_table
 from scr.extract_html import remove_titles_from_html
 from scr.extract_html import add_clients_after_titles
+from scr.extract_html import Newsletter
+from scr.extract_html import cached_events
+from scr.extract_html import html_to_markdown_with_table
+from scr.client_matrix import ClientMatrix
 
 def matrix_client_events(list_events):
-    return [[event, []] for event in list_events]
+    return ClientMatrix(list_events)
+
+
+def read_event_lines(text_file):
+    """Set of the non-empty lines of text_file, stripped of list dashes and whitespace."""
+    with open(text_file, "r", encoding="utf-8") as f:
+        return {line.strip("- \n\t").strip() for line in f if line.strip()}
 
 
 def add_client_in_matrice(matrix, client_num, text_file):
     """
     For each line in text_file, if the line (event) matches one in the matrix, add the client number.
     Args:
-        matrix (list): Output from matrix_client_events
+        matrix (ClientMatrix or list): Output from matrix_client_events
         client_num (int or str): Client number to add
         text_file (str): Path to the text file with event titles
     Modifies:
         matrix in-place (adds client_num where there is a match)
     """
-    # Read the text file and clean up each line
-    with open(text_file, "r", encoding="utf-8") as f:
-        lines = [line.strip("- \n\t").strip() for line in f if line.strip()]
+    lines = read_event_lines(text_file)
+    if isinstance(matrix, ClientMatrix):
+        for line in lines:
+            matrix.add(line, client_num)
+        return matrix
 
     # For each event in the matrix, check if it is present in the lines
     for event_row in matrix:
-        event = event_row[0]
-        if event in lines:
+        if event_row[0] in lines:
             event_row[1].append(client_num)
     return matrix
 
-def add_clients_from_report(matrix, report_txt_path, max_event_prefix=10):
+
+def add_clients_in_matrice(matrix, client_files):
     """
-    Fills the matrix (event -> clients) and collects explanations for each client.
-    Returns: (matrix, explanations_list)
-      explanations_list: list of (client_number, explanation_text)
+    Bulk version of add_client_in_matrice.
+    Args:
+        matrix (ClientMatrix or list): Output from matrix_client_events
+        client_files (iterable): (client_num, text_file) pairs, processed in order
+    Modifies:
+        matrix in-place, exactly as successive add_client_in_matrice calls would
     """
-    # Build event map as before
-    event_map = {}
-    for idx, (event, _) in enumerate(matrix):
-        event_prefix = event.split('-')[0][:max_event_prefix].strip().lower()
-        event_map[event_prefix] = idx
+    if isinstance(matrix, ClientMatrix):
+        for client_num, text_file in client_files:
+            for line in read_event_lines(text_file):
+                matrix.add(line, client_num)
+        return matrix
+
+    event_rows = {}
+    for event_row in matrix:
+        event_rows.setdefault(event_row[0], []).append(event_row)
 
+    for client_num, text_file in client_files:
+        for line in read_event_lines(text_file):
+            for event_row in event_rows.get(line, ()):
+                event_row[1].append(client_num)
+    return matrix
+
+CLIENT_HEADER = re.compile(r"^===\s*(MC\d+)\s*===\s*$")
+
+
+def iter_report_blocks(report_txt_path):
+    """
+    Reads the LLM report line by line and yields one (client_number, lines) pair per
+    "=== MCxxxxxxx ===" block; lines are stripped and empty ones dropped.
+    Only the current block is held in memory.
+    """
+    client_number = None
+    lines = []
     with open(report_txt_path, 'r', encoding='utf-8') as f:
-        text = f.read()
+        for raw_line in f:
+            header = CLIENT_HEADER.match(raw_line)
+            if header:
+                if client_number is not None and lines:
+                    yield client_number, lines
+                client_number = header.group(1)
+                lines = []
+                continue
+            if client_number is not None:
+                line = raw_line.strip()
+                if line:
+                    lines.append(line)
+    if client_number is not None and lines:
+        yield client_number, lines
 
-    # Split into blocks by client, pattern: "=== MCxxxxxxx ==="
-    client_blocks = re.split(r"^===\s*(MC\d+)\s*===\s*$", text, flags=re.MULTILINE)
-    # re.split alternates: ['', client1, block1, client2, block2, ...]
-    explanations = []
 
-    # Process each client block
-    for i in range(1, len(client_blocks), 2):
-        client_number = client_blocks[i]
-        block = client_blocks[i+1]
-        if not client_number or not block:
-            continue
+def iter_clients_from_report(matrix, report_txt_path, max_event_prefix=10):
+    """
+    Streams the report: for each client block, adds the client to the matrix rows of
+    the events it lists, then yields (client_number, explanation).
+    The matrix is up to date for every block already yielded, so the caller may stop early.
+    """
+    event_map = {}
+    for idx, (event, _) in enumerate(matrix):
+        event_prefix = event.split('-')[0][:max_event_prefix].strip().lower()
+        event_map[event_prefix] = idx
 
-        # Split block into lines and remove empty lines
-        lines = [line.strip() for line in block.strip().split('\n') if line.strip()]
-        if not lines:
-            continue
+    def event_row(line):
+        dash_pos = line.find('-')
+        if dash_pos == -1:
+            return None
+        return event_map.get(line[:dash_pos][:max_event_prefix].strip().lower())
 
-        # Find event lines: lines with a '-' within first 10 chars, or matching normalized event names
-        event_lines = []
+    for client_number, lines in iter_report_blocks(report_txt_path):
+        # Event lines come first: a '-' whose prefix matches a normalized event name
         explanation_start_idx = 0
-        for idx, line in enumerate(lines):
-            dash_pos = line.find('-')
-            event_candidate = line[:dash_pos][:max_event_prefix].strip().lower() if dash_pos != -1 else ''
-            if dash_pos != -1 and event_candidate in event_map:
-                event_lines.append(line)
-            else:
-                explanation_start_idx = idx
+        for line_idx, line in enumerate(lines):
+            idx = event_row(line)
+            if idx is None:
+                explanation_start_idx = line_idx
                 break
-
-        # Add client to matrix for each detected event in event_lines
-        for line in event_lines:
-            dash_pos = line.find('-')
-            if dash_pos == -1:
-                continue
-            event_candidate = line[:dash_pos][:max_event_prefix].strip().lower()
-            if event_candidate in event_map:
-                idx = event_map[event_candidate]
-                if client_number not in matrix[idx][1]:
-                    matrix[idx][1].append(client_number)
+            if client_number not in matrix[idx][1]:
+                matrix[idx][1].append(client_number)
 
         # The explanation is everything from explanation_start_idx onward
         explanation = "\n".join(lines[explanation_start_idx:]).strip()
+        yield client_number, explanation
+
+
+def add_clients_from_report(matrix, report_txt_path, max_event_prefix=10, max_clients=None):
+    """
+    Fills the matrix (event -> clients) and collects explanations for each client.
+    Stops after max_clients client blocks when it is given.
+    Returns: (matrix, explanations_list)
+      explanations_list: list of explanation texts
+    """
+    explanations = []
+    for count, (client_number, explanation) in enumerate(
+            iter_clients_from_report(matrix, report_txt_path, max_event_prefix), start=1):
         if explanation and not explanation.lower().startswith("aucun"):
-            explanations.append((explanation))
+            explanations.append(explanation)
+        if max_clients is not None and count >= max_clients:
+            break
 
     return matrix, explanations
 
@@ -96,46 +148,40 @@ def remove_titles_from_matrix(matrice, titre_NP):
     """
     Removes any row from matrice whose first element matches a title in titre_NP.
     Args:
-        matrice (list): Matrix of [title, clients] pairs.
+        matrice (ClientMatrix or list): Matrix of [title, clients] pairs.
         titre_NP (list): List of titles to remove.
     Returns:
-        list: Filtered matrix.
+        ClientMatrix or list: Filtered matrix (a ClientMatrix is filtered in place).
     """
+    if isinstance(matrice, ClientMatrix):
+        return matrice.remove_titles(titre_NP)
     titre_NP_set = set(titre_NP)
     return [row for row in matrice if row[0] not in titre_NP_set]
 
 
 
-def matcli(path):
+def matcli(path, output_md_path="data/newsletter_md.md", digest_path=None, chars_per_title=600, titles_path=None):
+    """
+    Converts the newsletter to Markdown and returns the empty client matrix of its titles.
+
+    The titles are those of the table of contents (get_all_events), extracted once per
+    HTML content (see cached_events). With titles_path they are also written there as a
+    JSON list; with digest_path, the condensed per-title digest used in the section
+    prompts is written too.
+    """
     print("matcli function is running")
-    titres = ['BHP ( Market-Perform vs Outperform, TP 1900p vs 2000p)',
- 'Défense',
- 'Telco France',
- 'Eco Australie',
- 'Eco Chine',
- 'Centrica (=)',
- 'Equinor (+)',
- 'Kering (=)',
- 'Vodafone (=)',
- 'Land Securities',
- 'Aramis (=/+)',
- 'H&M (Underperform, TP: 110SEK)',
- 'Conviction Thinking',
- 'Equity Strategy',
- 'Covered Bonds Special',
- 'Credit Strategy Weekly Webcast – Can you spell insatiable?',
- 'Credit Strategy Weekly Webcast',
- 'EM Trade Idea Monitor - SG EM Trade Idea Monitor',
- 'Fixed Income Portfolio Strategy',
- 'Technical Analysis: 10y UST',
- 'Diageo',
- 'Emeis',
- 'Electric Revolution: Divergence — From Centralized Energy to Portable Power — Powering the Sustainable',
- 'Global Trucks: Pair trade - Long PACCAR',
- 'Porsche (04/06)',
- 'BMW (26/06)']
-    matrix_client_events = [[event, []] for event in titres]
-    html_to_markdown_with_table(path, "data/newsletter_md.md")
+    with open(path, "r", encoding="utf-8") as f:
+        html = f.read()
+    # The DOM is only needed for the digest; cached_events parses html itself on a miss
+    newsletter = Newsletter(html) if digest_path is not None else None
+    titres = cached_events(html, newsletter=newsletter)
+    if titles_path is not None:
+        with open(titles_path, "w", encoding="utf-8") as f:
+            json.dump(titres, f, ensure_ascii=False, indent=2)
+    matrix_client_events = ClientMatrix(titres)
+    html_to_markdown_with_table(path, output_md_path)
+    if digest_path is not None:
+        newsletter.write_digest(digest_path, titres, chars_per_title)
     return matrix_client_events
 
 if __name__ == "__main__":
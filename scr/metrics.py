@@ -0,0 +1,131 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    """Peak resident memory of the process so far, or None where the resource module is missing."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """
+    In-process registry of timing spans.
+
+    Each span name accumulates its call count, total and maximum duration, the counts
+    attached to it (rows, sections, titles...) and the process peak memory observed when
+    it ended, including how much that peak grew while it ran. render_prometheus() exports
+    everything in the Prometheus text format.
+    """
+
+    def __init__(self, prefix="newsletter"):
+        self.prefix = prefix
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **counts):
+        """
+        Times the with-block under name. The yielded dict receives counts known only
+        inside the block, e.g. `with metrics.span("excel_load") as s: ...; s["rows"] = len(df)`.
+        """
+        counts = dict(counts)
+        peak_before = peak_rss_bytes()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self._record(name, time.perf_counter() - start, counts, peak_before, peak_rss_bytes())
+
+    def timed(self, name, counts=None):
+        """Decorator timing every call of a function; counts(result) gives the counts to attach."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name) as span_counts:
+                    result = func(*args, **kwargs)
+                    if counts is not None:
+                        span_counts.update(counts(result))
+                    return result
+            return wrapper
+        return decorator
+
+    def _record(self, name, seconds, counts, peak_before, peak_after):
+        with self._lock:
+            entry = self._spans.setdefault(name, {
+                "calls": 0, "seconds": 0.0, "max_seconds": 0.0, "counts": {},
+                "peak_rss_bytes": None, "peak_rss_growth_bytes": 0,
+            })
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            for item, value in counts.items():
+                entry["counts"][item] = entry["counts"].get(item, 0) + value
+            if peak_after is not None:
+                entry["peak_rss_bytes"] = peak_after
+                entry["peak_rss_growth_bytes"] = max(entry["peak_rss_growth_bytes"], peak_after - peak_before)
+
+    def snapshot(self):
+        """Copy of the recorded spans, {name: {calls, seconds, max_seconds, counts, peak_rss_bytes, ...}}."""
+        with self._lock:
+            return {name: dict(entry, counts=dict(entry["counts"])) for name, entry in self._spans.items()}
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+
+    def render_prometheus(self, extra=None):
+        """
+        Spans (and extra {metric_name: (type, help, value)} gauges or counters) in the
+        Prometheus text exposition format.
+        """
+        p = self.prefix
+        spans = self.snapshot()
+        families = [
+            (f"{p}_span_calls_total", "counter", "Number of completed spans.",
+             [({"span": name}, entry["calls"]) for name, entry in spans.items()]),
+            (f"{p}_span_seconds_total", "counter", "Total time spent in the span.",
+             [({"span": name}, entry["seconds"]) for name, entry in spans.items()]),
+            (f"{p}_span_seconds_max", "gauge", "Longest single span.",
+             [({"span": name}, entry["max_seconds"]) for name, entry in spans.items()]),
+            (f"{p}_span_items_total", "counter", "Items (rows, sections, titles...) processed by the span.",
+             [({"span": name, "item": item}, value)
+              for name, entry in spans.items() for item, value in entry["counts"].items()]),
+            (f"{p}_span_peak_rss_bytes", "gauge", "Process peak resident memory when the span last ended.",
+             [({"span": name}, entry["peak_rss_bytes"]) for name, entry in spans.items()
+              if entry["peak_rss_bytes"] is not None]),
+            (f"{p}_span_peak_rss_growth_bytes", "gauge", "Largest growth of the process peak memory during one span.",
+             [({"span": name}, entry["peak_rss_growth_bytes"]) for name, entry in spans.items()]),
+        ]
+        peak = peak_rss_bytes()
+        if peak is not None:
+            families.append((f"{p}_process_peak_rss_bytes", "gauge", "Process peak resident memory.", [({}, peak)]))
+        for metric, (kind, help_text, value) in (extra or {}).items():
+            families.append((f"{p}_{metric}", kind, help_text, [({}, value)]))
+
+        lines = []
+        for metric, kind, help_text, samples in families:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(str(val))}"' for key, val in labels.items())
+                lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = Metrics()
+span = metrics.span
+timed = metrics.timed
@@ -0,0 +1,140 @@
+import re
+
+from scr.extract_html import normalize
+
+ISIN = re.compile(r"\b[A-Z]{2}[A-Z0-9]{9}[0-9]\b")
+PARENTHESES = re.compile(r"\([^)]*\)?")
+TOKEN = re.compile(r"[a-z0-9]+")
+
+# Legal forms and filler words dropped from issuer names
+NAME_STOPWORDS = {
+    "sa", "se", "ag", "nv", "plc", "spa", "ab", "asa", "inc", "ltd", "co", "corp", "group", "groupe",
+    "holding", "holdings", "the", "de", "la", "le", "les", "et", "and", "of", "reg", "act", "ord",
+}
+# Words too generic to identify an issuer on their own (sectors, countries, research products)
+GENERIC_WORDS = {
+    "global", "credit", "equity", "equities", "strategy", "fixed", "income", "technical", "analysis",
+    "defense", "telco", "france", "chine", "china", "europe", "euro", "australie", "australia", "trade",
+    "monitor", "weekly", "fund", "fonds", "bond", "bonds", "covered", "portfolio", "conviction", "electric",
+    "energy", "bank", "banque", "international", "world", "emerging", "market", "markets", "capital",
+}
+# Title spellings that do not look like the CRM issuer name
+ISSUER_ALIASES = {
+    "h&m": "hennes mauritz",
+    "lvmh": "moet hennessy louis vuitton",
+    "ab inbev": "anheuser busch inbev",
+    "bat": "british american tobacco",
+    "gsk": "glaxosmithkline",
+    "vw": "volkswagen",
+}
+
+
+def name_tokens(text):
+    """Significant normalized tokens of an instrument, issuer or title."""
+    return [token for token in TOKEN.findall(normalize(text)) if token not in NAME_STOPWORDS]
+
+
+def title_key(title):
+    """Issuer key of a newsletter title: parenthesized comments removed, aliases applied."""
+    core = normalize(PARENTHESES.sub(" ", title)).strip()
+    core = ISSUER_ALIASES.get(core, core)
+    return " ".join(name_tokens(core))
+
+
+class InstrumentIndex:
+    """
+    Offline index from instrument/issuer names and ISINs to the clients holding them.
+
+    Titles naming a company ('Kering (=)', 'Diageo', an ISIN) resolve to their holders
+    without the LLM; thematic titles ('Défense', 'Eco Chine') do not resolve and are left
+    to the LLM.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._isins = {}
+
+    def add(self, client, instrument=None, emmeteur=None, isin=None):
+        for name in (instrument, emmeteur):
+            if not isinstance(name, str):
+                continue
+            tokens = name_tokens(name)
+            if not tokens:
+                continue
+            self._names.setdefault(" ".join(tokens), set()).add(client)
+            # 'PORSCHE AUTOMOBIL HOLDING' must answer the title 'Porsche'
+            if len(tokens[0]) >= 3 and tokens[0] not in GENERIC_WORDS:
+                self._names.setdefault(tokens[0], set()).add(client)
+        if isinstance(isin, str) and isin.strip():
+            self._isins.setdefault(isin.strip().upper(), set()).add(client)
+
+    @classmethod
+    def from_sections(cls, sections):
+        """Index over the clients of a clients_sections list (names only: sections carry no ISIN)."""
+        index = cls()
+        for section in sections:
+            for client in section["clients"]:
+                for inst in client["instruments"]:
+                    index.add(client["client_number"], inst.get("instrument"), inst.get("emmeteur"))
+        return index
+
+    @classmethod
+    def from_crm(cls, df_conseiller):
+        """
+        Index over the CRM rows of one advisor (names and ISINs), restricted to the rows
+        with an ISIN like the client sections (see clients_from_frame).
+        """
+        index = cls()
+        columns = ["Portfolio", "INSTRUMENT", "EMMETEUR", "CODE ISIN"]
+        rows = df_conseiller.reindex(columns=columns).astype(object)
+        rows = rows[rows["CODE ISIN"].notna()]
+        for portfolio, instrument, emmeteur, isin in rows.itertuples(index=False, name=None):
+            if isinstance(portfolio, str):
+                index.add(portfolio, instrument, emmeteur, isin)
+        return index
+
+    def resolve(self, title):
+        """Set of the clients holding the company named by title, or None if title is not a known issuer."""
+        holders = [self._isins[isin] for isin in ISIN.findall(title) if isin in self._isins]
+        if holders:
+            return set().union(*holders)
+        key = title_key(title)
+        if not key or key in GENERIC_WORDS:
+            return None
+        return self._names.get(key)
+
+
+def split_titles(titres, index):
+    """
+    Returns (resolved, ambiguous): resolved maps title indexes to their holders,
+    ambiguous lists the indexes of the titles to send to the LLM.
+    """
+    resolved = {}
+    ambiguous = []
+    for idx, title in enumerate(titres):
+        clients = index.resolve(title)
+        if clients is None:
+            ambiguous.append(idx)
+        else:
+            resolved[idx] = clients
+    return resolved, ambiguous
+
+
+def merge_section_lists(nb_titles, resolved, ambiguous, llm_list, section_clients):
+    """
+    Full per-title client list of one section, as the LLM would have returned it for all titles:
+    resolved titles get their holders among section_clients, ambiguous ones the LLM answer.
+    """
+    merged = [[] for _ in range(nb_titles)]
+    for idx, clients in resolved.items():
+        merged[idx] = [client for client in section_clients if client in clients]
+    for position, idx in enumerate(ambiguous):
+        if position < len(llm_list):
+            merged[idx] = llm_list[position]
+    return merged
+
+
+def direct_matches_summary(titres, merged, resolved):
+    """One line per resolved title held in the section, e.g. 'Kering (=) : MC1, MC2'."""
+    return "\n".join(f"{titres[idx]} : {', '.join(map(str, merged[idx]))}"
+                     for idx in sorted(resolved) if merged[idx])
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+RESPONSE_CACHE_PATH = "data/cache/responses.sqlite3"
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of parsed LLM answers, keyed by the SHA-256 of the section prompt.
+
+    An identical prompt (same clients, same newsletter, same titles) gets back the
+    (list, summary) pair divisiontext produced the first time, without any LLM call.
+    Entries older than ttl seconds are ignored and deleted; beyond max_entries the
+    least recently used ones are evicted. The SQLite file can be shared by several
+    processes.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=None, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:  # commits, or rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, prompt):
+        """Cached (the_list, summary) for this prompt, or None."""
+        key = prompt_key(prompt)
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._count(False)
+                return None
+            db.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self._count(True)
+        the_list, summary = json.loads(row[0])
+        return the_list, summary
+
+    def put(self, prompt, parsed):
+        """Stores the parsed answer (the_list, summary) of this prompt."""
+        now = time.time()
+        value = json.dumps(list(parsed), ensure_ascii=False)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_access, hits) VALUES (?, ?, ?, ?, 0)",
+                (prompt_key(prompt), value, now, now),
+            )
+            if self.max_entries is not None:
+                db.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def stats(self):
+        with self._connect() as db:
+            entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+
+from scr.extract_CRM_portfolio import build_association_prompt, read_json, read_md_file, render_section
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class SectionStore:
+    """
+    Client sections and newsletter markdown of one run, kept in memory.
+
+    Both files are read once and every section's client table is rendered up front
+    (compact=True for render_section_compact), so prompt() only formats the association
+    prompt. The files are read again only when their modification time or size changes.
+    """
+
+    def __init__(self, json_path, news_md_path, compact=False):
+        self.json_path = json_path
+        self.news_md_path = news_md_path
+        self.compact = compact
+        self._signature = None
+        self._state = ([], [], "")  # (sections, rendered sections, newsletter markdown)
+        self._lock = threading.Lock()
+
+    def _current(self):
+        """Up-to-date (sections, rendered sections, newsletter) snapshot."""
+        signature = (_file_signature(self.json_path), _file_signature(self.news_md_path))
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    sections = read_json(self.json_path)
+                    rendered = [render_section(section, compact=self.compact) for section in sections]
+                    self._state = (sections, rendered, read_md_file(self.news_md_path))
+                    self._signature = signature
+        return self._state
+
+    def __len__(self):
+        return len(self._current()[0])
+
+    @property
+    def sections(self):
+        return self._current()[0]
+
+    @property
+    def newsletter(self):
+        return self._current()[2]
+
+    def section_text(self, section_idx):
+        """Same text as generate_prompt_for_section for this section."""
+        return self._section_text(self._current()[1], section_idx)
+
+    @staticmethod
+    def _section_text(rendered, section_idx):
+        if not (0 <= section_idx < len(rendered)):
+            return f"Section {section_idx+1} does not exist in this file."
+        return rendered[section_idx]
+
+    def prompt(self, titres, section_idx):
+        """Same prompt as prompt_association, without reading any file."""
+        _, rendered, newsletter = self._current()
+        return build_association_prompt(self._section_text(rendered, section_idx), newsletter, titres)
+
+
+_stores = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def get_section_store(json_path, news_md_path, max_stores=32, compact=False):
+    """Shared SectionStore for these two files (the least recently used stores are dropped)."""
+    key = (os.path.abspath(json_path), os.path.abspath(news_md_path), compact)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SectionStore(json_path, news_md_path, compact=compact)
+            while len(_stores) > max_stores:
+                _stores.popitem(last=False)
+        else:
+            _stores.move_to_end(key)
+    return store
@@ -0,0 +1,83 @@
+from collections import deque
+
+
+class TitleMatcher:
+    """
+    Aho–Corasick automaton over a list of (already normalized) titles.
+
+    Built once, it tells in a single scan of a paragraph whether any title occurs in it
+    (contains_any) or which titles the paragraph starts with (first_prefix, prefixes),
+    instead of testing every title one after the other.
+    """
+
+    __slots__ = ("titles", "_goto", "_fail", "_own", "_has_output")
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        self._goto = [{}]   # state -> {char: next state}
+        self._own = [[]]    # state -> indexes of the titles ending exactly at this state
+
+        for idx, title in enumerate(self.titles):
+            state = 0
+            for char in title:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._own.append([])
+                state = next_state
+            self._own[state].append(idx)
+
+        # Failure links (breadth-first), and whether a title ends at a state or one of its suffixes
+        self._fail = [0] * len(self._goto)
+        self._has_output = [bool(own) for own in self._own]
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self._has_output[state] = self._has_output[state] or self._has_output[self._fail[state]]
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0) if state else 0
+                queue.append(next_state)
+
+    def contains_any(self, text):
+        """True if at least one title is a substring of text."""
+        if self._has_output[0]:
+            return True
+        goto, fail, has_output = self._goto, self._fail, self._has_output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if has_output[state]:
+                return True
+        return False
+
+    def first_prefix(self, text):
+        """Index of the first title (in list order) that text starts with, or None."""
+        best = min(self._own[0]) if self._own[0] else None
+        goto, own = self._goto, self._own
+        state = 0
+        for char in text:
+            state = goto[state].get(char)
+            if state is None:
+                break
+            if own[state] and (best is None or own[state][0] < best):
+                best = own[state][0]
+        return best
+
+    def prefixes(self, text):
+        """Indexes of all the titles text starts with, shortest titles first."""
+        found = list(self._own[0])
+        goto, own = self._goto, self._own
+        state = 0
+        for char in text:
+            state = goto[state].get(char)
+            if state is None:
+                break
+            found.extend(own[state])
+        return found
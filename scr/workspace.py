@@ -0,0 +1,104 @@
+import os
+import re
+import shutil
+import time
+import uuid
+
+WORKSPACES_DIR = "data/runs"
+
+_RUN_ID = re.compile(r"^[0-9a-f]{32}$")
+_RUN_JOB_ID = re.compile(r"^([0-9a-f]{32})-[0-9a-f]{8}$")
+
+
+def _last_modified(path):
+    """Latest modification time of a directory and of the files directly in it."""
+    with os.scandir(path) as entries:
+        return max([os.stat(path).st_mtime] + [entry.stat().st_mtime for entry in entries])
+
+
+class Workspace:
+    """
+    Directory holding every file of one run (uploads, sections, responses, markdown).
+
+    Each upload gets its own run ID, so concurrent users and server workers never
+    share the data/ files of another run.
+    """
+
+    def __init__(self, run_id=None, root=WORKSPACES_DIR):
+        if run_id is None:
+            run_id = uuid.uuid4().hex
+        elif not _RUN_ID.match(run_id):
+            raise ValueError(f"Identifiant de traitement invalide : {run_id!r}")
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def exists(run_id, root=WORKSPACES_DIR):
+        return bool(run_id) and bool(_RUN_ID.match(run_id)) and os.path.isdir(os.path.join(root, run_id))
+
+    @staticmethod
+    def prune(max_age, root=WORKSPACES_DIR):
+        """
+        Deletes the runs not modified for max_age seconds (uploads, CRM copy and results
+        included) and returns how many were deleted.
+        """
+        if not os.path.isdir(root):
+            return 0
+        limit = time.time() - max_age
+        deleted = 0
+        for run_id in os.listdir(root):
+            path = os.path.join(root, run_id)
+            try:
+                if _RUN_ID.match(run_id) and _last_modified(path) < limit:
+                    shutil.rmtree(path)
+                    deleted += 1
+            except OSError:  # removed meanwhile by another worker
+                pass
+        return deleted
+
+    @staticmethod
+    def run_of_job(job_id):
+        """Run ID of a job: the upload job uses the run ID itself, later jobs "<run_id>-<suffix>"."""
+        if job_id and _RUN_ID.match(job_id):
+            return job_id
+        match = _RUN_JOB_ID.match(job_id or "")
+        return match.group(1) if match else None
+
+    def new_job_id(self):
+        return f"{self.run_id}-{uuid.uuid4().hex[:8]}"
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def clients_sections(self):
+        return self.file("clients_sections.json")
+
+    @property
+    def results_processed(self):
+        return self.file("results_processed.json")
+
+    @property
+    def newsletter_md(self):
+        return self.file("newsletter_md.md")
+
+    @property
+    def news_resume(self):
+        return self.file("news_résume.md")
+
+    @property
+    def titles(self):
+        return self.file("titles.json")
+
+    @property
+    def crm(self):
+        return self.file("crm.xlsx")
+
+    @property
+    def job_status(self):
+        return self.file("job.json")
+
+    def job_file(self, job_id):
+        """Status file of a job of this run (job.json for the upload job)."""
+        return self.job_status if job_id == self.run_id else self.file(f"job_{job_id}.json")
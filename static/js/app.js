@@ -273,6 +273,96 @@ function downloadTextAsFile(content, filename, mimeType = 'text/plain') {
     window.URL.revokeObjectURL(url);
 }
 
+/**
+ * Poll the status of a background job until it finishes
+ * @param {string} jobId - Job identifier returned by /upload
+ * @param {Function} onProgress - Called with the job status at each poll
+ * @param {number} interval - Polling interval in milliseconds
+ * @returns {Promise<Object>} - Final job status (rejects if the job failed)
+ */
+async function pollJobStatus(jobId, onProgress = null, interval = 1000) {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const job = await response.json();
+
+        if (!job.success) {
+            throw new Error(job.error);
+        }
+        if (onProgress) {
+            onProgress(job);
+        }
+        if (job.status === 'done') {
+            return job;
+        }
+        if (job.status === 'error') {
+            throw new Error(job.error);
+        }
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
+/**
+ * Wait for an upload job, showing the running stage, then open its sections page
+ * @param {string} jobId - Job identifier returned by /upload
+ */
+async function waitForUploadJob(jobId) {
+    try {
+        const job = await pollJobStatus(jobId, (status) => {
+            const running = status.stages.find(stage => stage.status === 'running');
+            const percent = Math.round(status.progress * 100);
+            showLoadingOverlay(`${running ? running.label : 'En attente'}... (${percent}%)`);
+        });
+        hideLoadingOverlay();
+        window.location.href = `/sections/${job.result.nb_sections}`;
+    } catch (error) {
+        hideLoadingOverlay();
+        showNotification(`Erreur lors du traitement: ${error.message}`, 'error');
+    }
+}
+
+/**
+ * Fetch every section prompt in a single streamed request
+ * @param {Function} onPrompt - Called with (sectionIndex, prompt) as each prompt arrives
+ * @returns {Promise<string[]>} - All prompts, indexed by section
+ */
+async function fetchAllPrompts(onPrompt = null) {
+    const response = await fetch('/api/generate_prompts');
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('ndjson')) {
+        const error = await response.json();
+        throw new Error(error.error);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const prompts = [];
+    let buffer = '';
+
+    const handleLine = (line) => {
+        if (!line.trim()) {
+            return;
+        }
+        const item = JSON.parse(line);
+        prompts[item.section] = item.prompt;
+        if (onPrompt) {
+            onPrompt(item.section, item.prompt);
+        }
+    };
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer + decoder.decode());
+    return prompts;
+}
+
 // Initialize common functionality when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize Bootstrap tooltips
@@ -320,5 +410,8 @@ window.NewsletterApp = {
     hideLoadingOverlay,
     debounce,
     scrollToElement,
-    downloadTextAsFile
+    downloadTextAsFile,
+    pollJobStatus,
+    waitForUploadJob,
+    fetchAllPrompts
 };
\ No newline at end of file
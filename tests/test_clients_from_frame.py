@@ -0,0 +1,124 @@
+"""
+clients_from_frame (one pass over the CRM rows) against the per-portfolio loop of the
+original list_action_clients, kept below as the reference, on a seeded sample CRM.
+
+Known difference: rows without a Portfolio are skipped. The reference produced one
+client numbered NaN with no instrument for them, which then went into a section (and
+into clients_sections.json as an invalid NaN).
+"""
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+
+import pandas as pd
+
+from scr.extract_CRM_portfolio import clients_from_frame, load_crm
+
+SEED = 20250520
+ADVISORS = ['ROLLAND JEAN-MARC', 'DUPONT ANNE', 'MARTIN LUC']
+
+
+def reference_list_action_clients(conseiller, fichier_xlsx):
+    df = pd.read_excel(fichier_xlsx)
+    df_filtered = df[df['CONSEILLER'] == conseiller]
+    df_filtered = df_filtered[df_filtered['CODE ISIN'].notna()]
+
+    results = []
+    for portfolio in df_filtered['Portfolio'].unique():
+        portfolio_data = df_filtered[df_filtered['Portfolio'] == portfolio]
+        instruments_data = []
+        for _, row in portfolio_data.iterrows():
+            secteur = row.get('INSTRUMENT.1', 'N/A')
+            if pd.isna(secteur): secteur = 'N/A'
+            instrument = row.get('INSTRUMENT', 'N/A')
+            if pd.isna(instrument): instrument = 'N/A'
+            emmeteur = row.get('EMMETEUR', 'N/A')
+            if pd.isna(emmeteur): emmeteur = 'N/A'
+            instruments_data.append({
+                'instrument': instrument,
+                'emmeteur': emmeteur,
+                'secteur': secteur
+            })
+
+        instruments_count = Counter(portfolio_data['INSTRUMENT.1'].dropna())
+        countries_count = Counter(portfolio_data['EMMETEUR/PAYS DE RESIDENCE'].dropna())
+        instruments_str = ', '.join([f"{k}({v})" for k, v in instruments_count.items()])
+        countries_str = ', '.join([f"{k}({v})" for k, v in countries_count.items()])
+        results.append({
+            'Portfolio': portfolio,
+            'INSTRUMENTS_DATA': instruments_data,
+            'Countries_Summary': countries_str,
+            'Instruments_Summary': instruments_str
+        })
+
+    df_results = pd.DataFrame(results)
+    mask = df_results['INSTRUMENTS_DATA'].apply(len) <= 100
+    clients_moins_ou_egal_100 = df_results[mask].reset_index(drop=True)
+    return clients_moins_ou_egal_100
+
+
+def write_sample_crm(path, nb_rows=3000):
+    """CRM export with missing cells, portfolio-less rows and one portfolio over 100 instruments."""
+    rng = random.Random(SEED)
+    rows = []
+    for idx in range(nb_rows):
+        portfolio = f"MC{rng.randint(1, nb_rows // 20):06d}" if rng.random() > 0.02 else None
+        if idx < 120:
+            portfolio = "MC999999"
+        rows.append([
+            rng.choice(ADVISORS) if portfolio != "MC999999" else ADVISORS[0],
+            portfolio,
+            f"FR{rng.randint(0, 500):010d}" if rng.random() > 0.1 else None,
+            rng.choice(['KERING', 'VODAFONE GROUP', 'DIAGEO PLC', 'BMW AG', None, 'TOTAL']),
+            rng.choice(['Actions', 'Obligations', None, 'Fonds']),
+            rng.choice(['Kering SA', 'Vodafone', 'Diageo', None]),
+            rng.choice(['France', 'UK', 'Allemagne', None]),
+            rng.random(),
+        ])
+    # The CRM export has two INSTRUMENT columns: pandas reads the second one (the sector) as INSTRUMENT.1
+    columns = ['CONSEILLER', 'Portfolio', 'CODE ISIN', 'INSTRUMENT', 'INSTRUMENT',
+               'EMMETEUR', 'EMMETEUR/PAYS DE RESIDENCE', 'AUTRE']
+    pd.DataFrame(rows, columns=columns).to_excel(path, index=False)
+
+
+def as_records(clients):
+    return [(row['Portfolio'], row['INSTRUMENTS_DATA'], row['Countries_Summary'], row['Instruments_Summary'])
+            for row in clients.to_dict('records')]
+
+
+class ClientsFromFrameTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.crm_path = os.path.join(cls.tmp.name, 'crm.xlsx')
+        write_sample_crm(cls.crm_path)
+        cls.df = load_crm(cls.crm_path, cache_dir=None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_same_clients_as_reference(self):
+        dropped = 0
+        for conseiller in ADVISORS:
+            expected = reference_list_action_clients(conseiller, self.crm_path)
+            missing_portfolio = expected['Portfolio'].isna()
+            self.assertTrue(all(len(data) == 0 for data in expected.loc[missing_portfolio, 'INSTRUMENTS_DATA']))
+            dropped += missing_portfolio.sum()
+            expected = expected[~missing_portfolio]
+
+            actual = clients_from_frame(self.df[self.df['CONSEILLER'] == conseiller])
+            self.assertEqual(as_records(actual), as_records(expected), conseiller)
+        self.assertEqual(dropped, len(ADVISORS))
+
+    def test_sample_has_the_edge_cases(self):
+        rows = self.df[self.df['CONSEILLER'] == ADVISORS[0]]
+        self.assertTrue(rows['Portfolio'].isna().any())
+        self.assertNotIn('MC999999', set(clients_from_frame(rows)['Portfolio']))
+
+
+if __name__ == "__main__":
+    unittest.main()
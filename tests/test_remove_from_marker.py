@@ -0,0 +1,34 @@
+"""
+Newsletter.remove_from_marker: the lxml parser wraps every document in <html><body>,
+which always contain the marker, so the innermost element holding it must be the one
+cut, not the first matching tag.
+"""
+import unittest
+
+from scr.extract_html import Newsletter
+
+
+def body_after_removal(html, marker="MARKETING ANALYSTE"):
+    newsletter = Newsletter(html)
+    newsletter.remove_from_marker(marker)
+    return newsletter.soup.body.decode_contents()
+
+
+class RemoveFromMarkerTest(unittest.TestCase):
+
+    def test_fragment_keeps_what_precedes_the_marker(self):
+        html = "<p>keep me</p><div><p>MARKETING ANALYSTE</p></div><p>drop</p>"
+        self.assertEqual(body_after_removal(html), "<p>keep me</p><div></div>")
+
+    def test_full_document_is_cut_at_the_marker(self):
+        html = ("<html><body><p>a</p><table><tr><td>x</td></tr></table>"
+                "<p>Marketing <b>Analyste</b></p>tail<p>Contacts</p></body></html>")
+        self.assertEqual(body_after_removal(html), "<p>a</p><table><tr><td>x</td></tr></table>")
+
+    def test_without_marker_nothing_is_removed(self):
+        html = "<p>a</p><div><p>b</p></div>"
+        self.assertEqual(body_after_removal(html), html)
+
+
+if __name__ == "__main__":
+    unittest.main()